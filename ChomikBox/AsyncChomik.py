@@ -0,0 +1,732 @@
+from __future__ import unicode_literals
+
+import asyncio
+import os.path
+from collections import deque
+from datetime import datetime
+
+import aiohttp
+from requests_toolbelt.multipart.encoder import MultipartEncoderMonitor
+import xmltodict
+
+from .ChomikBox import Chomik, ChomikFile, ChomikFileColumns, ChomikFolder, ChomikUploader, SendActionFailedException, \
+    UnsupportedOperation, UploadException, new_hashers, ustr
+from .utils.Metrics import clock
+from .utils.RateLimiter import reserve
+
+# asyncio counterpart of Chomik, requires python 3.6+ and aiohttp
+# protocol handling (request building and response parsing) is shared with Chomik,
+# only transport is replaced with awaitable aiohttp calls
+# methods of folders are awaitable too (await folder.get(name)), generators (iter_files, iter_folders, walk, crawl)
+# are async generators, iterating folder itself is not supported
+
+
+class AsyncChomik(Chomik):
+    def __init__(self, name, password, aiohttp_session=None, ssl=True, cache=None, transport=None, metrics=None):
+        # pool size, keep-alive and timeouts of transport are applied to own aiohttp sessions, retries are not
+        assert isinstance(aiohttp_session, aiohttp.ClientSession) or aiohttp_session is None
+        self._aiohttp_session = aiohttp_session
+        Chomik.__init__(self, name, password, ssl=ssl, cache=cache, transport=transport, metrics=metrics)
+        self._login_lock = None
+
+    def _init_sessions(self, requests_session, web_session, transport):
+        # no requests sessions, aiohttp ones are created in event loop when needed
+        self.sess, self.sess_web = self._aiohttp_session, None
+        self._own_sess = self._aiohttp_session is None
+
+    def __repr__(self):
+        return '<ChomikBox.AsyncChomik: {n}>'.format(n=self.name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _session(self):
+        # aiohttp session has to be created inside running event loop
+        if self.sess is None:
+            self.sess = self._client_session()
+        return self.sess
+
+    def _client_session(self):
+        t = self.transport
+        connector = aiohttp.TCPConnector(limit_per_host=t.pool_maxsize, force_close=not t.keep_alive)
+        return aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(sock_connect=t.connect_timeout, sock_read=t.read_timeout))
+
+    async def close(self):
+        self.stop_keep_alive()
+        if self.sess_web is not None:
+            await self.sess_web.close()
+            self.sess_web = None
+        if self._own_sess and self.sess is not None:
+            await self.sess.close()
+            self.sess = None
+
+    def _lock(self):
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        return self._login_lock
+
+    async def _send_action(self, action, data, retry=True):
+        self.logger.debug('Sending action: "{}"'.format(action))
+        if self._relogin_needed(action):
+            async with self._lock():
+                # someone else could have logged in while we were waiting
+                if self._relogin_needed(action):
+                    self.metrics.relogin('expired')
+                    await self.login()
+
+        token = self._token
+        url, body, headers = self._action_request(action, data)
+        body = body.encode('utf-8')
+        started, received, parsed, error = clock(), 0, None, None
+        try:
+            async with self._session().post(url, data=body, headers=headers) as resp:
+                content = await resp.read()
+                text = content.decode(resp.get_encoding())
+            received, parsed = len(content), clock()
+            return self._action_result(action, text)
+        except Exception as e:
+            error = type(e).__name__
+            if not retry or not isinstance(e, SendActionFailedException) or not self._auth_failed(e):
+                raise
+        finally:
+            now = clock()
+            self.metrics.action('soap', action, now - started, len(body), received, now - parsed if parsed else 0, error)
+        self.metrics.retry(action)
+        async with self._lock():
+            if self._token == token:
+                self.logger.debug('Token rejected, logging in again')
+                self.metrics.relogin('rejected')
+                await self.login()
+        return await self._send_action(action, self._with_token(data), False)
+
+    def start_keep_alive(self, margin=30, interval=10):
+        # same as Chomik.start_keep_alive, but runs as task in current event loop
+        if self._keep_alive is None:
+            self._keep_alive = asyncio.ensure_future(self._keep_alive_loop(margin, interval))
+
+    async def _keep_alive_loop(self, margin, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if not self._token or (datetime.now() - self._last_action).total_seconds() < self.relogin_after - margin:
+                continue
+            try:
+                async with self._lock():
+                    self.metrics.relogin('keep_alive')
+                    await self.login()
+            except Exception as e:
+                self.logger.debug('Keep-alive login failed: {}'.format(e))
+
+    def stop_keep_alive(self):
+        if self._keep_alive is not None:
+            self._keep_alive.cancel()
+            self._keep_alive = None
+
+    async def _send_web_action(self, action, data):
+        self.logger.debug('Sending web action: "{}"'.format(action))
+        url, headers = self._web_action_request(action)
+        started, received, parsed, error = clock(), 0, None, None
+        try:
+            async with self.sess_web.post(url, data=data, headers=headers) as resp:
+                received = len(await resp.read())
+                parsed = clock()
+                try:
+                    return await resp.json(content_type=None)
+                except ValueError:
+                    error = 'ValueError'
+                    return False
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            now = clock()
+            self.metrics.action('web', action, now - started, 0, received, now - parsed if parsed else 0, error)
+
+    async def login(self):
+        url, params = self._logged_in(await self._send_action('Auth', self._auth_data()))
+
+        # Web login
+        if self.sess_web is None:
+            self.sess_web = self._client_session()
+        async with self.sess_web.get(url, params=params) as resp:
+            await resp.read()
+
+    async def logout(self):
+        self.stop_keep_alive()
+        await self._send_action('Logout', self._token_data())
+        self._logged_out()
+
+    async def files_list(self, only_downloadable=False, folder=None, refresh=False):
+        if folder is None:
+            folder = self
+        assert isinstance(folder, ChomikFolder)
+
+        if not refresh:
+            files = self._cached_files(folder, only_downloadable)
+            if files is not None:
+                return files
+
+        free_files = []
+        self.logger.debug('Loading files from folder {id}'.format(id=folder.folder_id))
+        try:
+            resp = await self._send_action('Download', self._files_request(folder))
+        except SendActionFailedException as e:
+            if self._no_files(e):
+                return self._files_listed(folder, [], only_downloadable)
+            raise
+
+        files = self._files_from_data(folder, resp, free_files)
+
+        if free_files:
+            self.logger.debug('Asking server for additional free files from folder {id}'.format(id=folder.folder_id))
+            resp = await self._send_action('Download', self._free_files_request(free_files))
+            files = self._merge_free_files(files, free_files, self._files_from_data(folder, resp))
+
+        return self._files_listed(folder, files, only_downloadable)
+
+    async def _load_folders(self, folder, depth=2):
+        self.logger.debug('Loading folders from folder {id} (depth {d})'.format(id=folder.folder_id, d=depth))
+        resp = await self._send_action('Folders', self._folders_request(folder, depth))
+        return self._folders_from_data(folder, resp['a:folder']['folders'], depth)
+
+    async def folders_list(self, folder=None, refresh=False):
+        if folder is None:
+            folder = self
+        assert isinstance(folder, ChomikFolder)
+
+        if folder._folders is None and not refresh:
+            self._cached_folders(folder)
+        if refresh or folder._folders is None:
+            await self._load_folders(folder)
+        return list(folder._folders)
+
+    async def load_tree(self, folder=None, depth=5):
+        if folder is None:
+            folder = self
+        assert isinstance(folder, ChomikFolder)
+        assert isinstance(depth, int) and depth >= 2
+
+        to_load = [folder]
+        while to_load:
+            # subtrees at the edge of previous responses are loaded concurrently
+            await asyncio.gather(*[self._load_folders(f, depth) for f in to_load])
+            stack, to_load = [c for f in to_load for c in f._folders], []
+            while stack:
+                sub = stack.pop()
+                if sub._folders is None:
+                    to_load.append(sub)
+                else:
+                    stack.extend(sub._folders)
+        return folder
+
+    async def get_folder(self, name, case_sensitive=True, folder=None):
+        return await self._get_folder(self if folder is None else folder, name, case_sensitive)
+
+    async def get_file(self, name, case_sensitive=True, folder=None):
+        return await self._get_file(self if folder is None else folder, name, case_sensitive)
+
+    async def get(self, name, case_sensitive=True, folder=None):
+        return await self._get(self if folder is None else folder, name, case_sensitive)
+
+    async def _get_folder(self, folder, name, case_sensitive):
+        assert isinstance(name, ustr)
+        if folder._folders is None:
+            await self.folders_list(folder)
+        return folder._lookup('_folders', name, case_sensitive)
+
+    async def _get_file(self, folder, name, case_sensitive):
+        assert isinstance(name, ustr)
+        if folder._files is None:
+            folder._files = await self.files_list(folder=folder)
+            folder._indexes = {}
+        return folder._lookup('_files', name, case_sensitive)
+
+    async def _get(self, folder, name, case_sensitive):
+        found = await self._get_folder(folder, name, case_sensitive)
+        if found is None:
+            found = await self._get_file(folder, name, case_sensitive)
+        return found
+
+    async def _list(self, folder, only_downloadable):
+        return await self.folders_list(folder) + await self.files_list(only_downloadable, folder)
+
+    def _iter_folder(self, folder):
+        raise UnsupportedOperation('Folders of AsyncChomik can\'t be iterated, use async for over iter_folders() and iter_files()')
+
+    async def iter_files(self, only_downloadable=False, folder=None, refresh=False):
+        # response isn't streamed here, files are yielded after whole listing is parsed
+        for f in await self.files_list(only_downloadable, folder, refresh):
+            yield f
+
+    async def iter_folders(self, folder=None, refresh=False):
+        for f in await self.folders_list(folder, refresh):
+            yield f
+
+    async def list_many(self, folders, only_downloadable=False, refresh=False):
+        # folders are listed concurrently, free files are resolved separately for every folder
+        for folder in folders:
+            assert isinstance(folder, ChomikFolder)
+        return list(await asyncio.gather(*[self.files_list(only_downloadable, folder, refresh) for folder in folders]))
+
+    async def files_columns(self, folders=None, only_downloadable=False, refresh=False):
+        columns = ChomikFileColumns()
+        for files in await self.list_many([self] if folders is None else folders, only_downloadable, refresh):
+            for f in files:
+                columns.append(f)
+        return columns
+
+    async def _listing(self, folder, only_downloadable):
+        return await self.folders_list(folder), await self.files_list(only_downloadable, folder)
+
+    async def walk(self, top=None, topdown=True, max_depth=None, only_downloadable=False, prefetch=0):
+        # same as Chomik.walk, prefetch > 0 lists so many upcoming folders concurrently as tasks
+        if top is None:
+            top = self
+        elif isinstance(top, ustr):
+            top = await self.get_path(top)
+        assert isinstance(top, ChomikFolder)
+
+        semaphore = asyncio.Semaphore(prefetch) if prefetch else None
+        prefetched = {}
+
+        async def limited(folder):
+            async with semaphore:
+                return await self._listing(folder, only_downloadable)
+
+        async def visit(folder, depth):
+            task = prefetched.pop(folder.folder_id, None)
+            folders, files = await task if task is not None else await self._listing(folder, only_downloadable)
+            deeper = max_depth is None or depth < max_depth
+            if semaphore is not None and deeper:
+                for sub in folders:
+                    prefetched[sub.folder_id] = asyncio.ensure_future(limited(sub))
+            return folders, files, deeper
+
+        async def bottom_up(folder, depth):
+            folders, files, deeper = await visit(folder, depth)
+            if deeper:
+                for sub in folders:
+                    async for item in bottom_up(sub, depth + 1):
+                        yield item
+            yield folder, folders, files
+
+        try:
+            if topdown:
+                stack = [(top, 0)]
+                while stack:
+                    folder, depth = stack.pop()
+                    folders, files, deeper = await visit(folder, depth)
+                    listed = list(folders)
+                    yield folder, folders, files
+                    if deeper:
+                        # prefetching of subtrees pruned by caller is cancelled
+                        kept = set(sub.folder_id for sub in folders)
+                        for sub in listed:
+                            if sub.folder_id not in kept and sub.folder_id in prefetched:
+                                prefetched.pop(sub.folder_id).cancel()
+                        stack.extend((sub, depth + 1) for sub in reversed(folders))
+            else:
+                async for item in bottom_up(top, 0):
+                    yield item
+        finally:
+            for task in prefetched.values():
+                task.cancel()
+
+    async def crawl(self, root=None, workers=4, only_downloadable=False, attempts=3, max_pending=None):
+        # same as Chomik.crawl, at most workers folders are listed at once
+        if root is None:
+            root = self
+        elif isinstance(root, ustr):
+            root = await self.get_path(root)
+        assert isinstance(root, ChomikFolder)
+        assert isinstance(workers, int) and workers > 0
+        if max_pending is None:
+            max_pending = 2 * workers
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def listing(folder):
+            async with semaphore:
+                return await self._listing(folder, only_downloadable)
+
+        queue, running, errors = deque([root]), {}, {}
+        try:
+            while queue or running:
+                while queue and len(running) < max_pending:
+                    folder = queue.popleft()
+                    running[asyncio.ensure_future(listing(folder))] = folder
+                done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    folder = running.pop(task)
+                    try:
+                        folders, files = task.result()
+                    except Exception as e:
+                        errors[folder.folder_id] = errors.get(folder.folder_id, 0) + 1
+                        if errors[folder.folder_id] >= attempts:
+                            raise
+                        self.logger.debug('Error {e} occurred during listing of folder {f}, retrying'.format(e=e, f=folder.folder_id))
+                        self.metrics.retry('crawl')
+                        queue.append(folder)
+                        continue
+                    queue.extend(folders)
+                    yield folder, files
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def get_path(self, path, case_sensitive=True):
+        assert isinstance(path, ustr)
+        path = list(filter(None, path.split('/')))
+        file = self
+        for name in path:
+            if name == '..':
+                file = file.parent_folder
+            elif name == '.':
+                pass
+            elif isinstance(file, ChomikFolder):
+                file = await self.get(name, case_sensitive, file)
+            else:
+                file = None
+            if file is None:
+                return
+        return file
+
+    async def new_folder(self, name, parent_folder=None):
+        assert isinstance(name, ustr)
+        if parent_folder is None:
+            parent_folder = self
+        assert isinstance(parent_folder, ChomikFolder)
+
+        self.logger.debug('Creating new folder "{n}" in {f}'.format(n=name, f=parent_folder.folder_id))
+        data = self._token_data(['newFolderId', parent_folder.folder_id], ['name', name])
+        data = await self._send_action('AddFolder', data)
+        return self._folder_added(name, data['a:folderId'], parent_folder)
+
+    async def rename_folder(self, name, folder):
+        assert isinstance(name, ustr)
+        if isinstance(folder, Chomik):
+            raise UnsupportedOperation
+        assert isinstance(folder, ChomikFolder)
+
+        self.logger.debug('Renaming folder {f} to {n}'.format(f=folder.folder_id, n=name))
+        await self._send_action('RenameFolder', self._token_data(['folderId', folder.folder_id], ['name', name]))
+        self._folder_renamed(folder, name)
+
+    async def move_folder(self, folder, to):
+        if isinstance(folder, Chomik):
+            raise UnsupportedOperation
+        assert isinstance(to, ChomikFolder)
+        assert isinstance(folder, ChomikFolder)
+
+        self.logger.debug('Moving folder {f} to {tf}'.format(f=folder.folder_id, tf=to.folder_id))
+        await self._send_action('MoveFolder', self._token_data(['folderId', folder.folder_id], ['newFolderId', to.folder_id]))
+        self._folder_moved(folder, to)
+
+    async def remove_folder(self, folder, force=False):
+        assert isinstance(force, bool)
+        if isinstance(folder, Chomik):
+            raise UnsupportedOperation
+        assert isinstance(folder, ChomikFolder)
+
+        self.logger.debug('Removing folder {f}'.format(f=folder.folder_id))
+        await self._send_action('RemoveFolder', self._token_data(['folderId', folder.folder_id], ['force', int(force)]))
+        self._folder_removed(folder)
+
+    async def modify_folder(self, folder, params):
+        if isinstance(folder, Chomik):
+            raise UnsupportedOperation
+        assert isinstance(folder, ChomikFolder)
+        assert isinstance(params, dict)
+
+        return self._folder_modified(folder, await self._send_action('ModifyFolder', self._modify_folder_data(folder, params)))
+
+    async def _bulk(self, items, request, apply, workers):
+        # bulk methods of Chomik (move_files, remove_files, move_folders, remove_folders, modify_folders) are awaitable
+        # here, at most workers requests run at once
+        assert isinstance(workers, int) and workers > 0
+        semaphore = asyncio.Semaphore(workers)
+
+        async def run(item):
+            async with semaphore:
+                return await request(item)
+
+        responses = await asyncio.gather(*[run(item) for item in items], return_exceptions=True)
+        results = []
+        for item, resp in zip(items, responses):
+            try:
+                if isinstance(resp, Exception):
+                    raise resp
+                results.append(apply(item, resp))
+            except Exception as e:
+                self.logger.debug('Error {e} occurred during bulk operation on {i}'.format(e=e, i=item))
+                results.append(e)
+        return results
+
+    async def set_folder_hidden(self, folder, hidden):
+        assert isinstance(hidden, bool)
+        self.logger.debug('Setting folder {f} hidden status to {h}'.format(f=folder.folder_id, h=hidden))
+        data = await self.modify_folder(folder, {'hidden': int(hidden)})
+        folder.hidden = True if data['a:folderDetails']['hidden'] == 'true' else False
+        return folder.hidden == hidden
+
+    async def set_folder_gallery_view(self, folder, gallery_view):
+        assert isinstance(gallery_view, bool)
+        self.logger.debug('Setting folder {f} gallery_view status to {h}'.format(f=folder.folder_id, h=gallery_view))
+        data = await self.modify_folder(folder, {'view': {'gallery': int(gallery_view)}})
+        folder.gallery_view = True if data['a:folderDetails']['view']['gallery'] == 'true' else False
+        return folder.gallery_view == gallery_view
+
+    async def set_folder_adult(self, folder, adult):
+        assert isinstance(adult, bool)
+        self.logger.debug('Setting folder {f} adult status to {h}'.format(f=folder.folder_id, h=adult))
+        data = await self.modify_folder(folder, {'adult': int(adult)})
+        folder.adult = True if data['a:folderDetails']['adult'] == 'true' else False
+        return folder.adult == adult
+
+    async def set_folder_password(self, folder, password):
+        if password and len(password) > 200:
+            raise ValueError('Password is too long')
+        if password == '':
+            password = None
+
+        self.logger.debug('Setting folder {f} password to {h}'.format(f=folder.folder_id, h=password))
+        data = await self.modify_folder(folder, {'passwd': int(password is not None), 'password': password})
+        folder.password = data['a:folderDetails']['password'] if data['a:folderDetails']['passwd'] == 'true' else None
+        return folder.password == password
+
+    async def rename_file(self, name, description, file):
+        assert isinstance(name, ustr)
+        assert isinstance(description, ustr)
+        assert isinstance(file, ChomikFile)
+
+        if name == '':
+            return False
+
+        # Cut extension
+        name = os.path.splitext(name)[0]
+
+        self.logger.debug('Renaming file {f} to {n}'.format(f=file.file_id, n=name))
+        data = {'FileId': file.file_id, 'Name': name, 'Description': description}
+        resp = await self._send_web_action('FileDetails/EditNameAndDescAction', data)
+        return self._file_renamed(file, name, resp)
+
+    async def move_file(self, file, to_folder):
+        assert isinstance(file, ChomikFile)
+        assert isinstance(to_folder, ChomikFolder)
+
+        self.logger.debug('Moving file {f} to {tf}'.format(f=file.file_id, tf=to_folder.folder_id))
+        resp = await self._send_web_action('FileDetails/MoveFileAction', self._file_action_data(file, to_folder.folder_id))
+        return self._file_moved(file, to_folder, resp)
+
+    async def remove_file(self, file):
+        assert isinstance(file, ChomikFile)
+
+        self.logger.debug('Removing file {f}'.format(f=file.file_id))
+        resp = await self._send_web_action('FileDetails/DeleteFileAction', self._file_action_data(file, 0))
+        return self._file_removed(file, resp)
+
+    async def upload_file(self, file_like_obj, name=None, progress_callback=None, folder=None, hashes=None, journal=None):
+        if name is None:
+            name = file_like_obj.name
+        if folder is None:
+            folder = self
+        if progress_callback is None:
+            progress_callback = lambda monitor: None
+        assert isinstance(name, ustr)
+        assert isinstance(folder, ChomikFolder)
+
+        session = journal.find(file_like_obj, self.chomik_id, folder.folder_id, name) if journal is not None else None
+        if session is not None:
+            key, stamp, server = session
+            self.logger.debug('Upload data for file "{n}" in folder {f} found in journal'.format(n=name, f=folder.folder_id))
+        else:
+            key, stamp, server = await self._upload_token(name, folder)
+            if journal is not None:
+                journal.add(file_like_obj, self.chomik_id, folder.folder_id, name, key, stamp, server)
+        self._files_changed(folder)
+
+        uploader = AsyncChomikUploader(self, folder, file_like_obj, name, server, key, stamp, progress_callback, hashes=hashes,
+                                       journal=journal)
+        uploader.continued = session is not None
+        return uploader
+
+    async def _upload_token(self, name, folder):
+        self.logger.debug('Getting file upload data for file "{n}" in folder {f}'.format(n=name, f=folder.folder_id))
+        data = await self._send_action('UploadToken', self._token_data(['folderId', folder.folder_id], ['fileName', name]))
+        return data['a:key'], data['a:stamp'], data['a:server']
+
+    async def open(self, chomik_file, start=0, chunk_size=65536):
+        # async generator of file contents starting from byte start
+        assert isinstance(chomik_file, ChomikFile)
+        assert chomik_file.downloadable
+
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        if start:
+            headers['Range'] = 'bytes={}-'.format(start)
+        async with self._session().get(chomik_file.url, headers=headers) as resp:
+            resp.raise_for_status()
+            async for data in resp.content.iter_chunked(chunk_size):
+                yield data
+
+    def download(self, chomik_file, save_file, progress_callback=None, chunk_size=65536, rate_limiter=None, hashes=None):
+        return AsyncChomikDownloader(self, chomik_file, save_file, progress_callback, chunk_size, rate_limiter, hashes)
+
+    def _open_file(self, file):
+        raise UnsupportedOperation('Files of AsyncChomik can\'t be opened as file objects, use async for over AsyncChomik.open()')
+
+    def _download_file(self, file, file_like, progress_callback, segments, rate_limiter, max_chunk_size, hashes, journal):
+        # ChomikFile.download of AsyncChomik file returns AsyncChomikDownloader, which has no segments and journal
+        if segments != 1 or max_chunk_size is not None or journal is not None:
+            raise UnsupportedOperation('Downloads of AsyncChomik support neither segments, max_chunk_size nor journal')
+        return self.download(file, file_like, progress_callback, rate_limiter=rate_limiter, hashes=hashes)
+
+
+class AsyncChomikUploader(ChomikUploader):
+    # file is read in chunks by MultipartEncoderMonitor, same as in ChomikUploader
+    chunk_size = 65536
+
+    def _throttle(self, amount):
+        # can't sleep inside of monitor callback in event loop, waiting is done by __body
+        self._delay += reserve(amount, self.rate_limiter, self.chomik.upload_limiter)
+
+    async def __body(self, monitor):
+        self._delay = 0
+        while True:
+            data = monitor.read(self.chunk_size)
+            if not data:
+                break
+            yield data
+            # let other tasks run between chunks
+            delay, self._delay = self._delay, 0
+            await asyncio.sleep(delay)
+            self._throttled += delay
+
+    async def __post(self, monitor):
+        headers = {'Content-Type': monitor.content_type, 'Content-Length': str(monitor.len), 'User-Agent': 'Mozilla/5.0'}
+        try:
+            # 's' if self.chomik.ssl else ''
+            t = self.chomik.transport
+            timeout = aiohttp.ClientTimeout(sock_connect=t.connect_timeout, sock_read=t.upload_read_timeout)
+            async with self.chomik._session().post('http://{server}/file/'.format(server=self.server),
+                                                   data=self.__body(monitor), headers=headers, timeout=timeout) as resp:
+                content = await resp.read()
+        except Exception:
+            if self.paused:
+                self.chomik.logger.debug('Upload of file "{n}" paused'.format(n=self.name))
+                return 'paused'
+            raise
+        finally:
+            self._close_reader()
+        self.chomik.logger.debug('Upload of file "{n}" finished'.format(n=self.name))
+        return self._upload_result(content)
+
+    async def start(self, attempts=0):
+        # attempts = -1 for infinite
+        assert isinstance(attempts, int)
+
+        if self.finished:
+            raise UploadException('Tried to start finished upload')
+        if self.started:
+            raise UploadException('Tried to start already started upload')
+        self.started = True
+
+        try:
+            if self.continued:
+                self.chomik.logger.debug('Continuing upload of file "{n}" from journal'.format(n=self.name))
+                try:
+                    return await self.resume()
+                except self.stale_session_errors as e:
+                    self.chomik.logger.debug('Upload session of file "{n}" from journal failed ({e}), starting new one'.format(
+                        n=self.name, e=e))
+                    self._new_session(await self.chomik._upload_token(self.name, self.folder))
+            monitor = MultipartEncoderMonitor.from_fields(fields=self._fields(self._start_part()), callback=self._callback)
+            self.chomik.logger.debug('Started uploading file "{n}" to folder {f}'.format(n=self.name, f=self.folder.folder_id))
+            return await self.__post(monitor)
+        except Exception as e:
+            self.chomik.logger.debug('Error {e} occurred during upload of file "{n}"'.format(e=e, n=self.name))
+            attempt = 1
+            while attempts == -1 or attempts >= attempt:
+                try:
+                    self.chomik.logger.debug('Resuming failed upload of file "{n}"'.format(n=self.name))
+                    return await self.resume()
+                except Exception as ex:
+                    e = ex
+                    self.chomik.logger.debug('Error {e} occurred during upload of file "{n}"'.format(e=ex, n=self.name))
+                    attempt += 1
+            raise e
+
+    async def resume(self):
+        if self.finished:
+            raise UploadException('Tried to resume finished upload')
+        self.paused = False
+
+        # 's' if self.chomik.ssl else ''
+        async with self.chomik._session().get('http://{server}/resume/check/?key={key}'.format(server=self.server, key=self.key),
+                                              headers={'User-Agent': 'Mozilla/5.0'}) as resp:
+            resp = xmltodict.parse(await resp.read())['resp']
+
+        resume_from = int(resp['@file_size'])
+        part = self._resume_part(resume_from)
+        monitor = MultipartEncoderMonitor.from_fields(fields=self._fields(part, resume_from), callback=self._callback)
+        self.chomik.logger.debug('Resumed uploading file "{n}" to folder {f} from {b} bytes'.format(n=self.name, f=self.folder.folder_id, b=resume_from))
+        return await self.__post(monitor)
+
+
+class AsyncChomikDownloader(object):
+    def __init__(self, chomik, chomik_file, save_file, progress_callback=None, chunk_size=65536, rate_limiter=None, hashes=None):
+        assert isinstance(chomik, AsyncChomik)
+        assert isinstance(chomik_file, ChomikFile)
+        assert hasattr(save_file, 'write')
+        assert isinstance(chunk_size, int)
+        assert chomik_file.downloadable
+
+        self.chomik, self.chomik_file, self.save_file, self.chunk_size = chomik, chomik_file, save_file, chunk_size
+        self.paused, self.finished, self.started, self.bytes_downloaded = False, False, False, 0
+        self.download_size = chomik_file.size
+        self.progress_callback = progress_callback
+        self.rate_limiter = rate_limiter
+        self.hashers = new_hashers(hashes)
+
+    @property
+    def hexdigests(self):
+        return dict((name, h.hexdigest()) for name, h in self.hashers.items())
+
+    @property
+    def name(self):
+        return self.chomik_file.name
+
+    def pause(self):
+        self.paused = True
+
+    async def __dwn(self):
+        async for data in self.chomik.open(self.chomik_file, self.bytes_downloaded, self.chunk_size):
+            delay = reserve(len(data), self.rate_limiter, self.chomik.download_limiter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.save_file.write(data)
+            for h in self.hashers.values():
+                h.update(data)
+            self.bytes_downloaded += len(data)
+            if self.progress_callback is not None:
+                self.progress_callback(self)
+            if self.paused:
+                return 'paused'
+        self.finished = True
+        return True
+
+    async def start(self):
+        if self.finished:
+            raise UploadException('Tried to start finished download')
+        if self.started:
+            raise UploadException('Tried to start already started download')
+        self.started = True
+        return await self.__dwn()
+
+    async def resume(self):
+        if self.finished:
+            raise UploadException('Tried to resume finished download')
+        self.paused = False
+        return await self.__dwn()
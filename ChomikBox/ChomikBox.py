@@ -1,25 +1,40 @@
 from __future__ import unicode_literals
 
+import hashlib
+import io
 import logging
+import mmap
 import os.path
 import sys
-from collections import OrderedDict
+import threading
+import time
+from array import array
+from itertools import chain
+from collections import OrderedDict, deque
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from hashlib import md5
+from xml.etree import ElementTree
 
 import requests
 import xmltodict
-from requests_toolbelt.multipart.encoder import MultipartEncoderMonitor
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
 
 from .PartFile import PartFile, total_len
+from .utils.DownloadJournal import DownloadJournal
+from .utils.MetadataCache import MetadataCache
+from .utils.Metrics import Metrics, clock
+from .utils.RateLimiter import RateLimiter, reserve
+from .utils.ReadAheadFile import ReadAheadFile
 from .utils.SeekableHTTPFile import SeekableHTTPFile
+from .utils.StreamBuffer import StreamBuffer
+from .utils.UploadJournal import UploadJournal
+from .utils.Transport import Transport
 
 CHOMIKBOX_VERSION = '2.0.8.2'
 
-# TODO: speed limits for downloader and uploader
 # TODO: function to refresh file url (reopen file?)
-# TODO: whole folder tree caching (as done in original ChomikBox)
-# TODO: refresh cached tree when listing folders (if needed)
 
 if sys.version_info >= (3, 0):
     # noinspection PyUnresolvedReferences
@@ -48,9 +63,27 @@ else:
     from urllib import quote_plus
 
 
+def new_hashers(hashes):
+    # hashlib object for every algorithm name in hashes, like ('md5', 'sha1')
+    return OrderedDict((name, hashlib.new(name)) for name in hashes or ())
+
+
+def readable(file):
+    # whether file object can be read, files without readable() (Python 2 file) are judged by their mode
+    try:
+        return file.readable()
+    except AttributeError:
+        mode = getattr(file, 'mode', 'r')
+        return not isinstance(mode, str) or 'r' in mode or '+' in mode
+    except ValueError:
+        # closed file
+        return False
+
+
 class SendActionFailedException(Exception):
-    def __init__(self, action, error=None):
-        self.action, self.error = action, error
+    # status - value of status element of response, None when there was none
+    def __init__(self, action, error=None, status=None):
+        self.action, self.error, self.status = action, error, status
         Exception.__init__(self, '{}: {}'.format(action, error))
 
 
@@ -85,23 +118,65 @@ class ChomikSOAP(object):
         data = xmltodict.parse(xml_data, *args, **kwargs)
         return data['s:Envelope']['s:Body']
 
+    @staticmethod
+    def _local_name(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    @staticmethod
+    def namespace(elem):
+        # '{namespace}' prefix of element's tag, children of response elements are in the same namespace
+        return elem.tag[:elem.tag.find('}') + 1]
+
+    @staticmethod
+    def child_text(elem, name, ns=None):
+        # text of child element with local name name, None when it's missing or empty (e.g. i:nil)
+        text = elem.findtext((ChomikSOAP.namespace(elem) if ns is None else ns) + name)
+        return ustr(text) if text else None
+
+    @staticmethod
+    def iterparse(stream, tags):
+        # incrementally yields (tag, element) of outermost elements with local name in tags, element is dropped
+        # when next one is requested, so it has to be used right away and memory usage doesn't grow with response size
+        names, stack, opened = {}, [], 0
+        for event, elem in ElementTree.iterparse(stream, events=('start', 'end')):
+            tag = names.get(elem.tag)
+            if tag is None:
+                tag = names[elem.tag] = ChomikSOAP._local_name(elem.tag)
+            if event == 'start':
+                stack.append(elem)
+                if tag in tags:
+                    opened += 1
+                continue
+            stack.pop()
+            if tag in tags:
+                opened -= 1
+                if not opened:
+                    yield tag, elem
+                    if stack:
+                        stack[-1].remove(elem)
 
 class ChomikFile(object):
+    # there may be millions of files listed, so no per instance __dict__, chomik is taken from parent folder
+    __slots__ = ('name', 'file_id', 'parent_folder', 'size', 'url')
+
     def __init__(self, chomik, name, file_id, parent_folder, size, url=None):
         assert isinstance(chomik, Chomik)
         assert isinstance(name, ustr)
         assert isinstance(parent_folder, ChomikFolder)
         assert isinstance(url, ustr) or url is None
 
-        self.chomik, self.name, self.file_id = chomik, name, int(file_id)
+        self.name, self.file_id = chomik._intern(name), int(file_id)
         self.parent_folder, self.size, self.url = parent_folder, size, url
 
+    @property
+    def chomik(self):
+        return self.parent_folder.chomik
+
     def __repr__(self):
         return '<ChomikBox.ChomikFile: "{p}"{i}({c})>'.format(p=self.path, i=' ' if self.downloadable else '-not downloadable- ', c=self.chomik.name)
 
     def open(self):
-        if self.downloadable:
-            return SeekableHTTPFile(self.url, self.name, self.chomik.sess)
+        return self.chomik._open_file(self)
 
     @property
     def downloadable(self):
@@ -120,11 +195,68 @@ class ChomikFile(object):
     def remove(self):
         return self.chomik.remove_file(self)
 
-    def download(self, file_like, progress_callback=None):
-        return ChomikDownloader(self.chomik, self, file_like, progress_callback)
+    def download(self, file_like, progress_callback=None, segments=1, rate_limiter=None, max_chunk_size=None, hashes=None,
+                 journal=None):
+        return self.chomik._download_file(self, file_like, progress_callback, segments, rate_limiter, max_chunk_size, hashes,
+                                          journal)
+
+
+class ChomikFileColumns(object):
+    # compact listing of many files as parallel arrays instead of ChomikFile objects
+    # names and urls are kept UTF-8 encoded in one buffer each, with arrays of their end offsets (empty url is None)
+    try:
+        int64 = array(str('q')).typecode
+    except ValueError:
+        # python 2 has no long long arrays
+        int64 = array(str('l')).typecode
+
+    def __init__(self):
+        self.folder_ids, self.file_ids, self.sizes = array(self.int64), array(self.int64), array(self.int64)
+        self._names, self._urls = bytearray(), bytearray()
+        self._name_ends, self._url_ends = array(self.int64), array(self.int64)
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    @staticmethod
+    def _text(buf, ends, n):
+        return bytes(buf[ends[n - 1] if n else 0:ends[n]]).decode('utf-8')
+
+    def name(self, n):
+        return self._text(self._names, self._name_ends, n)
+
+    def url(self, n):
+        return self._text(self._urls, self._url_ends, n) or None
+
+    def __getitem__(self, n):
+        # (folder_id, file_id, name, size, url) of n-th file
+        if n < 0:
+            n += len(self)
+        return self.folder_ids[n], self.file_ids[n], self.name(n), self.sizes[n], self.url(n)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def add(self, folder_id, file_id, name, size, url=None):
+        self.folder_ids.append(folder_id)
+        self.file_ids.append(file_id)
+        self.sizes.append(size)
+        self._names += name.encode('utf-8')
+        self._name_ends.append(len(self._names))
+        if url is not None:
+            self._urls += url.encode('utf-8')
+        self._url_ends.append(len(self._urls))
+
+    def append(self, file):
+        assert isinstance(file, ChomikFile)
+        self.add(file.parent_folder.folder_id, file.file_id, file.name, file.size, file.url)
 
 
 class ChomikFolder(object):
+    __slots__ = ('chomik', 'folder_id', 'name', 'parent_folder', 'hidden', 'adult', 'gallery_view', 'password',
+                 '_folders', '_files', '_indexes', '_path', '_path_generation')
+
     def __init__(self, chomik, name, folder_id, parent_folder, hidden, adult, gallery_view, password):
         assert isinstance(chomik, Chomik)
         assert isinstance(name, ustr)
@@ -133,9 +265,15 @@ class ChomikFolder(object):
         assert isinstance(adult, bool)
         assert isinstance(gallery_view, bool)
 
-        self.chomik, self.folder_id, self.name = chomik, int(folder_id), name
+        self.chomik, self.folder_id, self.name = chomik, int(folder_id), chomik._intern(name)
         self.parent_folder, self.hidden, self.adult, self.gallery_view = parent_folder, hidden, adult, gallery_view
         self.password = password
+        # cached child folders and files (kept only for name lookups), None when not loaded yet
+        self._folders, self._files = None, None
+        # name -> child dicts over cached children, built lazily by _lookup
+        self._indexes = {}
+        # path cached at chomik._tree_generation, which changes on every folder rename or move
+        self._path, self._path_generation = None, -1
 
     @classmethod
     def cache(cls, chomik, name, folder_id, parent_folder, hidden, adult, gallery_view, password):
@@ -148,6 +286,10 @@ class ChomikFolder(object):
             assert isinstance(adult, bool)
             assert isinstance(gallery_view, bool)
             fol = chomik._folder_cache[folder_id]
+            if fol.parent_folder is not parent_folder and fol.parent_folder is not None:
+                fol.parent_folder._forget_child(fol)
+            if fol.parent_folder is not parent_folder or fol.name != name:
+                chomik._paths_changed()
             fol.name, fol.parent_folder, fol.hidden, fol.adult, fol.gallery_view = name, parent_folder, hidden, adult, gallery_view
             fol.password = password
         else:
@@ -155,67 +297,78 @@ class ChomikFolder(object):
             chomik._folder_cache[folder_id] = fol
         return fol
 
+    def _forget_child(self, folder):
+        if self._folders is not None and folder in self._folders:
+            self._folders.remove(folder)
+            self._indexes = {}
+
+    def _lookup(self, kind, name, case_sensitive):
+        # kind is '_folders' or '_files', first child with given name wins as in linear search
+        index = self._indexes.get((kind, case_sensitive))
+        if index is None:
+            index = {}
+            for f in reversed(getattr(self, kind)):
+                index[f.name if case_sensitive else str_casefold(f.name)] = f
+            self._indexes[(kind, case_sensitive)] = index
+        return index.get(name if case_sensitive else str_casefold(name))
+
     def __repr__(self):
         return '<ChomikBox.ChomikFolder: "{p}" ({c})>'.format(p=self.path, c=self.chomik.name)
 
     def __iter__(self):
-        return iter(self.list())
+        return self.chomik._iter_folder(self)
+
+    def files_list(self, only_downloadable=False, refresh=False):
+        return self.chomik.files_list(only_downloadable, self, refresh)
+
+    def iter_files(self, only_downloadable=False, refresh=False):
+        return self.chomik.iter_files(only_downloadable, self, refresh)
+
+    def folders_list(self, refresh=False):
+        return self.chomik.folders_list(self, refresh)
+
+    def iter_folders(self, refresh=False):
+        return self.chomik.iter_folders(self, refresh)
 
-    def files_list(self, only_downloadable=False):
-        return self.chomik.files_list(only_downloadable, self)
+    def walk(self, topdown=True, max_depth=None, only_downloadable=False, prefetch=0):
+        return self.chomik.walk(self, topdown, max_depth, only_downloadable, prefetch)
 
-    def folders_list(self):
-        return self.chomik.folders_list(self)
+    def crawl(self, workers=4, only_downloadable=False, attempts=3, max_pending=None):
+        return self.chomik.crawl(self, workers, only_downloadable, attempts, max_pending)
+
+    def load_tree(self, depth=5):
+        return self.chomik.load_tree(self, depth)
 
     def list(self, only_downloadable=False):
-        return self.folders_list() + self.files_list(only_downloadable)
+        return self.chomik._list(self, only_downloadable)
 
     def get_folder(self, name, case_sensitive=True):
-        assert isinstance(name, ustr)
-        if case_sensitive:
-            for f in self.folders_list():
-                if f.name == name:
-                    return f
-        else:
-            name = str_casefold(name)
-            for f in self.folders_list():
-                if str_casefold(f.name) == name:
-                    return f
+        return self.chomik._get_folder(self, name, case_sensitive)
 
     def get_file(self, name, case_sensitive=True):
-        assert isinstance(name, ustr)
-        if case_sensitive:
-            for f in self.files_list():
-                if f.name == name:
-                    return f
-        else:
-            name = str_casefold(name)
-            for f in self.files_list():
-                if str_casefold(f.name) == name:
-                    return f
+        return self.chomik._get_file(self, name, case_sensitive)
 
     def get(self, name, case_sensitive=True):
-        assert isinstance(name, ustr)
-        found = self.get_folder(name, case_sensitive)
-        if found is None:
-            found = self.get_file(name, case_sensitive)
-        return found
+        return self.chomik._get(self, name, case_sensitive)
 
     @property
     def path(self):
-        return self.parent_folder.path + self.name + '/'
+        if self._path_generation != self.chomik._tree_generation:
+            self._path = self.parent_folder.path + self.name + '/'
+            self._path_generation = self.chomik._tree_generation
+        return self._path
 
     def new_folder(self, name):
         return self.chomik.new_folder(name, self)
 
     def rename(self, name):
-        self.chomik.rename_folder(name, self)
+        return self.chomik.rename_folder(name, self)
 
     def move(self, to):
-        self.chomik.move_folder(self, to)
+        return self.chomik.move_folder(self, to)
 
     def remove(self, force=False):
-        self.chomik.remove_folder(self, force)
+        return self.chomik.remove_folder(self, force)
 
     def modify(self, params):
         return self.chomik.modify_folder(self, params)
@@ -232,22 +385,50 @@ class ChomikFolder(object):
     def set_password(self, password):
         return self.chomik.set_folder_password(self, password)
 
-    def upload_file(self, file_like_obj, name=None, progress_callback=None):
-        return self.chomik.upload_file(file_like_obj, name, progress_callback, self)
+    def upload_file(self, file_like_obj, name=None, progress_callback=None, hashes=None, journal=None):
+        return self.chomik.upload_file(file_like_obj, name, progress_callback, self, hashes, journal)
 
 
 class Chomik(ChomikFolder):
-    def __init__(self, name, password, requests_session=None, ssl=True):
+    def __init__(self, name, password, requests_session=None, ssl=True, cache=None, transport=None, web_session=None,
+                 metrics=None):
+        # transport configures pooling, retries and timeouts of own sessions, passed sessions are tuned only when
+        # transport is given explicitly
+        # metrics (Metrics, e.g. MemoryMetrics) gets latency and sizes of actions, re-logins, retries and transfers
         assert isinstance(name, ustr)
         assert isinstance(password, ustr)
         assert isinstance(requests_session, requests.Session) or requests_session is None
+        assert isinstance(web_session, requests.Session) or web_session is None
+        assert isinstance(cache, MetadataCache) or cache is None
+        assert isinstance(transport, Transport) or transport is None
+        assert isinstance(metrics, Metrics) or metrics is None
 
         self.__password = password
-        self.sess = requests.session() if requests_session is None else requests_session
+        self.metrics = Metrics() if metrics is None else metrics
+        self.transport = Transport() if transport is None else transport
+        self._init_sessions(requests_session, web_session, transport)
         self.ssl = ssl
         self.__token, self.chomik_id = '', 0
         self._last_action = datetime.now()
+        # token is considered expired after so many idle seconds
+        self.relogin_after = 300
+        self._relogin_lock = threading.Lock()
+        self._keep_alive, self._keep_alive_stop = None, None
         self._folder_cache = {}
+        self.cache = cache
+        # max count of free files resolved in one Download request, None for no limit (all pending free files of
+        # folder, or of folders listed together, are resolved in one request)
+        self.free_files_batch = None
+        # bytes of streamed upload kept in memory, so it can be resumed
+        self.upload_replay_size = 8 * 2 ** 20
+        # defaults of new uploaders, see ChomikUploader
+        self.upload_stall_timeout, self.upload_min_speed, self.upload_read_ahead = None, 0, None
+        # RateLimiter shared by all uploads / downloads of this chomik, None for unlimited
+        self.upload_limiter, self.download_limiter = None, None
+        self._tree_generation = 0
+        # equal file and folder names share one string object when enabled (repeated names in big trees)
+        self.intern_names = False
+        self._names = {}
         self.logger = logging.getLogger('ChomikBox.Chomik.{}'.format(name))
         # TODO: init adult & gallery_view properly
         ChomikFolder.__init__(self, self, name, 0, None, False, False, False, None)
@@ -255,152 +436,752 @@ class Chomik(ChomikFolder):
     def __repr__(self):
         return '<ChomikBox.Chomik: {n}>'.format(n=self.name)
 
-    def _send_action(self, action, data):
-        self.logger.debug('Sending action: "{}"'.format(action))
-        if action != 'Auth':
-            if not self.__token:
-                raise NotLoggedInException
-            if (datetime.now() - self._last_action).total_seconds() > 300 and action != 'Logout':
+    def _init_sessions(self, requests_session, web_session, transport):
+        if requests_session is None:
+            self.sess = self.transport.session(self.metrics)
+        else:
+            self.sess = requests_session if transport is None else transport.mount(requests_session, self.metrics)
+        if web_session is not None and transport is not None:
+            transport.mount(web_session, self.metrics)
+        # created on first login when not given
+        self.sess_web = web_session
+
+    def _intern(self, name):
+        if self.intern_names:
+            return self._names.setdefault(name, name)
+        return name
+
+    def _paths_changed(self):
+        self._tree_generation += 1
+
+    def _token_data(self, *items):
+        return OrderedDict([['token', self.__token]] + list(items))
+
+    @property
+    def _token(self):
+        return self.__token
+
+    def _relogin_needed(self, action):
+        if action == 'Auth':
+            return False
+        if not self.__token:
+            raise NotLoggedInException
+        return (datetime.now() - self._last_action).total_seconds() > self.relogin_after and action != 'Logout'
+
+    # statuses and whole error messages (compared case-insensitively) of actions rejected because token is not valid
+    # anymore, only these are sent again after re-login, as other failed actions may have been partially applied
+    auth_statuses = ('NotLoggedIn', 'InvalidToken', 'TokenExpired')
+    auth_errors = ('not logged in', 'invalid token', 'token expired', 'session expired')
+
+    def _auth_failed(self, e):
+        if e.action in ('Auth', 'Logout'):
+            return False
+        return e.status in self.auth_statuses or \
+            (isinstance(e.error, ustr) and e.error.strip().rstrip('.').lower() in self.auth_errors)
+
+    def _with_token(self, data):
+        # request data with current token, after failed one was replaced
+        if isinstance(data, dict) and 'token' in data:
+            data = OrderedDict(data)
+            data['token'] = self.__token
+        return data
+
+    def _ensure_login(self, action):
+        # single-flight re-login, threads waiting for lock reuse login done by first of them
+        if self._relogin_needed(action):
+            with self._relogin_lock:
+                if self._relogin_needed(action):
+                    self.metrics.relogin('expired')
+                    self.login()
+
+    def _relogin(self, token):
+        # re-login after token was rejected, unless some other thread already did it
+        with self._relogin_lock:
+            if self.__token == token:
+                self.logger.debug('Token rejected, logging in again')
+                self.metrics.relogin('rejected')
                 self.login()
 
+    def start_keep_alive(self, margin=30, interval=10):
+        # logs in again in background thread margin seconds before token would expire, so no action waits for it
+        if self._keep_alive is not None:
+            return
+        stop = self._keep_alive_stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                if not self.__token or (datetime.now() - self._last_action).total_seconds() < self.relogin_after - margin:
+                    continue
+                try:
+                    with self._relogin_lock:
+                        if not stop.is_set() and self.__token:
+                            self.metrics.relogin('keep_alive')
+                            self.login()
+                except Exception as e:
+                    self.logger.debug('Keep-alive login failed: {}'.format(e))
+
+        self._keep_alive = threading.Thread(target=run, name='ChomikBox keep-alive {}'.format(self.name))
+        self._keep_alive.daemon = True
+        self._keep_alive.start()
+
+    def stop_keep_alive(self):
+        if self._keep_alive is not None:
+            self._keep_alive_stop.set()
+            if self._keep_alive is not threading.current_thread():
+                self._keep_alive.join()
+            self._keep_alive, self._keep_alive_stop = None, None
+
+    def _action_request(self, action, data):
+        # url, body and headers of SOAP action request
         headers = {'SOAPAction': 'http://chomikuj.pl/IChomikBoxService/{}'.format(action), 'User-Agent': 'Mozilla/5.0',
                    'Content-Type': 'text/xml;charset=utf-8', 'Accept-Language': 'en-US,*'}
-        data = ChomikSOAP.pack(action, data)
-        resp = self.sess.post('http{}://box.chomikuj.pl/services/ChomikBoxService.svc'.format('s' if self.ssl else ''), data, headers=headers)
-        resp = ChomikSOAP.unpack(resp.text)['{}Response'.format(action)]['{}Result'.format(action)]
+        url = 'http{}://box.chomikuj.pl/services/ChomikBoxService.svc'.format('s' if self.ssl else '')
+        return url, ChomikSOAP.pack(action, data), headers
+
+    def _action_result(self, action, xml_data):
+        resp = ChomikSOAP.unpack(xml_data)['{}Response'.format(action)]['{}Result'.format(action)]
         if 'a:hamsterName' in resp and isinstance(resp['a:hamsterName'], ustr):
             self.name = resp['a:hamsterName']
         if 'a:status' in resp and resp['a:status'] != 'Ok':
             if isinstance(resp['a:errorMessage'], ustr):
-                raise SendActionFailedException(action, resp['a:errorMessage'])
+                raise SendActionFailedException(action, resp['a:errorMessage'], resp['a:status'])
             else:
-                raise SendActionFailedException(action)
+                raise SendActionFailedException(action, status=resp['a:status'])
         elif 'status' in resp and resp['status']['#text'] != 'Ok':
             if '#text' in resp['errorMessage']:
-                raise SendActionFailedException(action, resp['errorMessage']['#text'])
+                raise SendActionFailedException(action, resp['errorMessage']['#text'], resp['status']['#text'])
             else:
-                raise SendActionFailedException(action)
+                raise SendActionFailedException(action, status=resp['status']['#text'])
         self._last_action = datetime.now()
         self.logger.debug('Action sent: "{}"'.format(action))
         return resp
 
+    def _send_action(self, action, data, retry=True):
+        # action rejected because of expired token is sent once again after re-login
+        self.logger.debug('Sending action: "{}"'.format(action))
+        self._ensure_login(action)
+
+        token = self.__token
+        url, body, headers = self._action_request(action, data)
+        started, received, parsed, error = clock(), 0, None, None
+        try:
+            resp = self.sess.post(url, body, headers=headers, timeout=self.transport.timeout)
+            received, parsed = len(resp.content), clock()
+            return self._action_result(action, resp.text)
+        except Exception as e:
+            error = type(e).__name__
+            if not retry or not isinstance(e, SendActionFailedException) or not self._auth_failed(e):
+                raise
+        finally:
+            now = clock()
+            self.metrics.action('soap', action, now - started, len(body), received, now - parsed if parsed else 0, error)
+        self.metrics.retry(action)
+        self._relogin(token)
+        return self._send_action(action, self._with_token(data), False)
+
+    def _stream_action(self, action, data, tags, retry=True):
+        # same as _send_action, but yields (tag, dict) of elements in tags parsed straight from response stream
+        # it's retried after re-login only if nothing was yielded yet
+        self.logger.debug('Sending action: "{}"'.format(action))
+        self._ensure_login(action)
+
+        token, yielded = self.__token, False
+        try:
+            for item in self._stream_response(action, data, tags):
+                yielded = True
+                yield item
+        except SendActionFailedException as e:
+            if yielded or not retry or not self._auth_failed(e):
+                raise
+            self.metrics.retry(action)
+            self._relogin(token)
+            for item in self._stream_action(action, self._with_token(data), tags, False):
+                yield item
+
+    def _stream_response(self, action, data, tags):
+        # latency doesn't include time spent by consumer of yielded elements, parse time includes reading of response
+        url, data, headers = self._action_request(action, data)
+        status, error, failure = None, None, None
+        started, parse_time, received = clock(), 0, 0
+        try:
+            with closing(self.sess.post(url, data, headers=headers, stream=True, timeout=self.transport.timeout)) as resp:
+                # e.g. SOAP Fault, it has no status element
+                resp.raise_for_status()
+                resp.raw.decode_content = True
+                elements = ChomikSOAP.iterparse(resp.raw, set(tags) | {'status', 'errorMessage'})
+                while True:
+                    parsed = clock()
+                    item = next(elements, None)
+                    parse_time += clock() - parsed
+                    if item is None:
+                        break
+                    tag, elem = item
+                    if tag == 'status':
+                        status = elem.text
+                    elif tag == 'errorMessage':
+                        error = elem.text
+                    else:
+                        paused = clock()
+                        try:
+                            yield tag, elem
+                        finally:
+                            started += clock() - paused
+                received = resp.raw.tell()
+            if status is None:
+                raise SendActionFailedException(action, 'No status in response')
+            if status != 'Ok':
+                raise SendActionFailedException(action, error, status)
+        except Exception as e:
+            failure = type(e).__name__
+            raise
+        finally:
+            self.metrics.action('soap', action, clock() - started, len(data), received, parse_time, failure)
+        self._last_action = datetime.now()
+        self.logger.debug('Action sent: "{}"'.format(action))
+
+    def _web_action_request(self, action):
+        # url and headers of web action request
+        headers = {'User-Agent': 'Mozilla/5.0', 'Content-Type': 'application/x-www-form-urlencoded', 'Accept-Language': 'en-US,*'}
+        return 'http{}://chomikuj.pl/action/{}'.format('s' if self.ssl else '', action), headers
+
     def _send_web_action(self, action, data):
         self.logger.debug('Sending web action: "{}"'.format(action))
-        headers = {'User-Agent': 'Mozilla/5.0', 'Content-Type': 'application/x-www-form-urlencoded', 'Accept-Language': 'en-US,*'}
-        resp = self.sess_web.post('http{}://chomikuj.pl/action/{}'.format('s' if self.ssl else '', action), data=data, headers=headers)
+        url, headers = self._web_action_request(action)
+        started, received, parsed, error = clock(), 0, None, None
         try:
-            return resp.json()
-        except ValueError:
-            return False
-
-    def login(self):
-        data = OrderedDict([['name', self.name], ['passHash', md5(self.__password.encode('utf-8')).hexdigest()],
+            resp = self.sess_web.post(url, data=data, headers=headers, timeout=self.transport.timeout)
+            received, parsed = len(resp.content), clock()
+            try:
+                return resp.json()
+            except ValueError:
+                error = 'ValueError'
+                return False
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            now = clock()
+            sent = len(resp.request.body or b'') if parsed else 0
+            self.metrics.action('web', action, now - started, sent, received, now - parsed if parsed else 0, error)
+
+    def _auth_data(self):
+        return OrderedDict([['name', self.name], ['passHash', md5(self.__password.encode('utf-8')).hexdigest()],
                             ['client', {'name': 'chomikbox', 'version': CHOMIKBOX_VERSION}], ['ver', '4']])
-        resp = self._send_action('Auth', data)
+
+    def _logged_in(self, resp):
+        # stores Auth result, returns url and params of web login
         self.chomik_id = int(resp['a:hamsterId'])
         self.__token = resp['a:token']
         self.logger.debug('Logged in with token {}'.format(self.__token))
+        return 'http{}://chomikuj.pl/chomik/chomikbox/LoginFromBox'.format('s' if self.ssl else ''), {'t': self.__token, 'returnUrl': self.name}
+
+    def _logged_out(self):
+        self.__token = ''
+        self.logger.debug('Logged out')
+
+    def login(self):
+        url, params = self._logged_in(self._send_action('Auth', self._auth_data()))
 
         # Web login
-        # TODO: add ability to pass sess_web as parameter
-        self.sess_web = requests.session()
-        self.sess_web.get('http{}://chomikuj.pl/chomik/chomikbox/LoginFromBox'.format('s' if self.ssl else ''), params={'t': self.__token, 'returnUrl': self.name})
+        if self.sess_web is None:
+            self.sess_web = self.transport.session(self.metrics)
+        self.sess_web.get(url, params=params, timeout=self.transport.timeout)
 
     def logout(self):
-        self._send_action('Logout', {'token': self.__token})
-        self.__token = ''
-        self.logger.debug('Logged out')
+        self.stop_keep_alive()
+        self._send_action('Logout', self._token_data())
+        self._logged_out()
 
     @property
     def path(self):
         return '/'
 
-    def files_list(self, only_downloadable=False, folder=None):
-        if folder is None:
-            folder = self
-        assert isinstance(folder, ChomikFolder)
+    def _cache_folders(self, folder):
+        if self.cache is not None:
+            if folder._folders is None:
+                self.cache.invalidate_folders(self.chomik_id, folder.folder_id)
+            else:
+                self.cache.set_folders(self.chomik_id, folder.folder_id, [(f.folder_id, f.name, f.hidden, f.adult, f.gallery_view, f.password)
+                                                                         for f in folder._folders])
+
+    def _files_changed(self, folder):
+        folder._files, folder._indexes = None, {}
+        if self.cache is not None:
+            self.cache.invalidate_files(self.chomik_id, folder.folder_id)
+
+    def _cached_files(self, folder, only_downloadable):
+        if self.cache is not None:
+            cached = self.cache.get_files(self.chomik_id, folder.folder_id)
+            if cached is not None:
+                files = [ChomikFile(self, name, file_id, folder, size, url) for file_id, name, size, url in cached]
+                if only_downloadable:
+                    files = list(filter(lambda x: x.downloadable, files))
+                return files
+
+    def _files_listed(self, folder, files, only_downloadable):
+        # files loaded for name lookups (get_file) are replaced by new listing
+        if folder._files is not None:
+            folder._files, folder._indexes = list(files), {}
+        if self.cache is not None:
+            self.cache.set_files(self.chomik_id, folder.folder_id, [(f.file_id, f.name, f.size, f.url) for f in files])
+        if only_downloadable:
+            files = list(filter(lambda x: x.downloadable, files))
+        return files
 
-        free_files = {}
-
-        def file(data):
-            url = data['url'] if isinstance(data['url'], ustr) else None
-            f = ChomikFile(self, data['name'], data['id'], folder, int(data['size']), url)
-            if url is None:
-                for a in data['agreementInfo']['AgreementInfo']:
-                    if 'name' in a and 'cost' in a and a['cost'] == '0':
-                        if a['name'] not in free_files:
-                            free_files[a['name']] = []
-                        free_files[a['name']].append(f)
-                        break
-            return f
-
-        def files_gen(data):
-            data = data['a:list']['DownloadFolder']['files']
-            if data is not None:
-                data = data['FileEntry']
-                if isinstance(data, list):
-                    for f in data:
-                        yield file(f)
-                else:
-                    yield file(data)
+    def _download_request(self, entries):
+        return self._token_data(['sequence', {'stamp': 0, 'part': 0, 'count': 1}], ['disposition', 'download'], ['list', {'DownloadReqEntry': entries}])
+
+    def _files_request(self, folder):
+        return self._download_request(OrderedDict([['id', quote_plus('/{}{}'.format(self.name, folder.path), '()/').replace('%', '*')],
+                                                   ['agreementInfo', {'AgreementInfo': {'name': 'own'}}]]))
+
+    def _free_files_request(self, free_files):
+        return self._download_request([OrderedDict([['id', f.file_id], ['agreementInfo', {'AgreementInfo': {'name': name}}]])
+                                       for name, f in free_files])
 
-        def dwn_req_data(data):
-            return OrderedDict([['token', self.__token], ['sequence', {'stamp': 0, 'part': 0, 'count': 1}], ['disposition', 'download'], ['list', {'DownloadReqEntry': data}]])
+    @staticmethod
+    def _no_files(e):
+        return e.action == "Download" and e.error == 'failed : requested file(s) not available'
+
+    @staticmethod
+    def _free_agreement(data):
+        # name of free agreement of not downloadable file, None when there's none
+        for a in data['agreementInfo']['AgreementInfo']:
+            if 'name' in a and 'cost' in a and a['cost'] == '0':
+                return a['name']
+
+    def _file_from_data(self, folder, data, free_files=None):
+        # returns file and whether it waits for free agreement (then (agreement name, file) is also added to free_files)
+        url = data['url'] if isinstance(data['url'], ustr) else None
+        f = ChomikFile(self, data['name'], data['id'], folder, int(data['size']), url)
+        if url is None and free_files is not None:
+            agreement = self._free_agreement(data)
+            if agreement is not None:
+                free_files.append((agreement, f))
+                return f, True
+        return f, False
+
+    def _file_from_elem(self, folder, elem, free_files=None):
+        # _file_from_data of FileEntry element streamed by iterparse
+        ns, text = ChomikSOAP.namespace(elem), ChomikSOAP.child_text
+        url = text(elem, 'url', ns)
+        f = ChomikFile(self, text(elem, 'name', ns), elem.findtext(ns + 'id'), folder, int(elem.findtext(ns + 'size')), url)
+        if url is None and free_files is not None:
+            for a in elem.iterfind('{n}agreementInfo/{n}AgreementInfo'.format(n=ns)):
+                if a.findtext(ns + 'cost') == '0' and a.find(ns + 'name') is not None:
+                    free_files.append((text(a, 'name', ns), f))
+                    return f, True
+        return f, False
+
+    def _files_from_data(self, folder, data, free_files=None):
+        files = []
+        data = data['a:list']['DownloadFolder']['files']
+        if data is not None:
+            data = data['FileEntry']
+            if not isinstance(data, list):
+                data = [data]
+            for d in data:
+                files.append(self._file_from_data(folder, d, free_files)[0])
+        return files
 
-        a_data = dwn_req_data(OrderedDict([['id', quote_plus('/{}{}'.format(self.name, folder.path), '()/').replace('%', '*')], ['agreementInfo', {'AgreementInfo': {'name': 'own'}}]]))
+    @staticmethod
+    def _merge_free_files(files, free_files, resolved):
+        # files waiting for agreement are replaced by resolved ones
+        pending = set(f.file_id for _, f in free_files)
+        return [f for f in files if f.file_id not in pending] + resolved
+
+    def _resolve_free_files(self, free_files):
+        # free files of any folders are resolved in batches of free_files_batch, returns resolved files
+        folders, resolved = dict((f.file_id, f.parent_folder) for _, f in free_files), []
+        size = self.free_files_batch or len(free_files)
+        for start in range(0, len(free_files), size):
+            batch = free_files[start:start + size]
+            self.logger.debug('Asking server for {n} additional free files'.format(n=len(batch)))
+            for _, e in self._stream_action('Download', self._free_files_request(batch), ['FileEntry']):
+                resolved.append(self._file_from_elem(folders[int(ChomikSOAP.child_text(e, 'id'))], e)[0])
+        return resolved
+
+    def _list_files(self, folder):
+        # returns files and free files waiting for agreement, without asking server for them
+        free_files = []
         self.logger.debug('Loading files from folder {id}'.format(id=folder.folder_id))
         try:
-            resp = self._send_action('Download', a_data)
+            files = [self._file_from_elem(folder, e, free_files)[0]
+                     for _, e in self._stream_action('Download', self._files_request(folder), ['FileEntry'])]
         except SendActionFailedException as e:
-            if e.action == "Download" and e.error == 'failed : requested file(s) not available':
-                # no results
-                return []
-            else:
+            if not self._no_files(e):
                 raise
+            files = []
+        return files, free_files
+
+    def _resolve_listings(self, listings):
+        # listings - list of (folder, files, free_files), or (folder, files, None) for cached ones
+        # free files of all folders are resolved together, returns list of files lists
+        free_files = [ff for _, _, ffs in listings if ffs for ff in ffs]
+        resolved = {}
+        for f in self._resolve_free_files(free_files) if free_files else []:
+            resolved.setdefault(f.parent_folder.folder_id, []).append(f)
+        result = []
+        for folder, files, ffs in listings:
+            if ffs is not None:
+                files = self._files_listed(folder, self._merge_free_files(files, ffs, resolved.get(folder.folder_id, [])), False)
+            result.append(files)
+        return result
+
+    def iter_files(self, only_downloadable=False, folder=None, refresh=False):
+        # generator variant of files_list, files are yielded as soon as they are parsed from response
+        if folder is None:
+            folder = self
+        assert isinstance(folder, ChomikFolder)
 
-        files = list(files_gen(resp))
+        if not refresh:
+            files = self._cached_files(folder, only_downloadable)
+            if files is not None:
+                for f in files:
+                    yield f
+                return
 
-        if free_files:
-            a_data = []
-            for name, fs in dict_iteritems(free_files):
-                for ff in fs:
-                    a_data.append(OrderedDict([['id', ff.file_id], ['agreementInfo', {'AgreementInfo': {'name': name}}]]))
-                    files.remove(ff)
-            self.logger.debug('Asking server for additional free files from folder {id}'.format(id=folder.folder_id))
-            files.extend(files_gen(self._send_action('Download', dwn_req_data(a_data))))
+        # all files are kept only when they're going to be cached or used for name lookups
+        keep = self.cache is not None or folder._files is not None
+        files, free_files = [], []
+        self.logger.debug('Loading files from folder {id}'.format(id=folder.folder_id))
+        try:
+            for _, e in self._stream_action('Download', self._files_request(folder), ['FileEntry']):
+                f, free = self._file_from_elem(folder, e, free_files)
+                if keep:
+                    files.append(f)
+                if not free and (f.downloadable or not only_downloadable):
+                    yield f
+        except SendActionFailedException as e:
+            if not self._no_files(e):
+                raise
 
+        resolved = self._resolve_free_files(free_files) if free_files else []
+        for f in resolved:
+            if f.downloadable or not only_downloadable:
+                yield f
+
+        if keep:
+            self._files_listed(folder, self._merge_free_files(files, free_files, resolved), only_downloadable)
+
+    def files_list(self, only_downloadable=False, folder=None, refresh=False):
+        return list(self.iter_files(only_downloadable, folder, refresh))
+
+    def list_many(self, folders, only_downloadable=False, refresh=False):
+        # files of many folders at once, free files of all of them are resolved in as few requests as possible
+        # returns list of files lists, in order of folders
+        listings = []
+        for folder in folders:
+            assert isinstance(folder, ChomikFolder)
+            files = None if refresh else self._cached_files(folder, False)
+            listings.append((folder, files, None) if files is not None else (folder,) + self._list_files(folder))
+        result = self._resolve_listings(listings)
         if only_downloadable:
-            files = list(filter(lambda x: x.downloadable, files))
+            result = [list(filter(lambda x: x.downloadable, files)) for files in result]
+        return result
+
+    def _iter_file_rows(self, folder):
+        # (file_id, name, size, url) of files in folder parsed straight from response, only files waiting for free
+        # agreement become ChomikFile objects
+        keep = self.cache is not None
+        rows, free_files = [], []
+        self.logger.debug('Loading files from folder {id}'.format(id=folder.folder_id))
+        try:
+            for _, e in self._stream_action('Download', self._files_request(folder), ['FileEntry']):
+                ns, text = ChomikSOAP.namespace(e), ChomikSOAP.child_text
+                url = text(e, 'url', ns)
+                if url is None and self._file_from_elem(folder, e, free_files)[1]:
+                    continue
+                row = (int(e.findtext(ns + 'id')), text(e, 'name', ns), int(e.findtext(ns + 'size')), url)
+                if keep:
+                    rows.append(row)
+                yield row
+        except SendActionFailedException as e:
+            if not self._no_files(e):
+                raise
 
-        return files
+        for f in self._resolve_free_files(free_files) if free_files else []:
+            row = (f.file_id, f.name, f.size, f.url)
+            if keep:
+                rows.append(row)
+            yield row
+
+        if keep:
+            self.cache.set_files(self.chomik_id, folder.folder_id, rows)
+        # files loaded for name lookups may be outdated now
+        folder._files, folder._indexes = None, {}
+
+    def files_columns(self, folders=None, only_downloadable=False, refresh=False):
+        # files of given folders (default: root) as ChomikFileColumns, parsed into columns without ChomikFile objects
+        columns = ChomikFileColumns()
+        for folder in [self] if folders is None else folders:
+            assert isinstance(folder, ChomikFolder)
+            rows = None if refresh or self.cache is None else self.cache.get_files(self.chomik_id, folder.folder_id)
+            for file_id, name, size, url in self._iter_file_rows(folder) if rows is None else rows:
+                if url is not None or not only_downloadable:
+                    columns.add(folder.folder_id, file_id, name, size, url)
+        return columns
+
+    def _folder_from_data(self, data, parent_folder):
+        hidden = True if data['hidden'] == 'true' else False
+        adult = True if data['adult'] == 'true' else False
+        gallery_view = True if data['view']['gallery'] == 'true' else False
+        password = data['password'] if data['passwd'] == 'true' else None
+        return ChomikFolder.cache(self, data['name'], data['id'], parent_folder, hidden, adult, gallery_view, password)
+
+    def _folder_tree_from_data(self, data, parent_folder, depth):
+        # depth counts parent_folder itself, so children of the deepest returned level are unknown
+        f = self._folder_from_data(data, parent_folder)
+        if depth > 2:
+            self._folders_from_data(f, data.get('folders'), depth - 1)
+        return f
+
+    def _folder_tree_from_elem(self, elem, parent_folder, depth, ns=None):
+        # _folder_tree_from_data of FolderInfo element streamed by iterparse
+        if ns is None:
+            ns = ChomikSOAP.namespace(elem)
+        text = elem.findtext
+        password = ChomikSOAP.child_text(elem, 'password', ns) if text(ns + 'passwd') == 'true' else None
+        f = ChomikFolder.cache(self, ChomikSOAP.child_text(elem, 'name', ns), text(ns + 'id'), parent_folder,
+                               text(ns + 'hidden') == 'true', text(ns + 'adult') == 'true',
+                               text('{n}view/{n}gallery'.format(n=ns)) == 'true', password)
+        if depth > 2:
+            self._folders_loaded(f, [self._folder_tree_from_elem(e, f, depth - 1, ns)
+                                     for e in elem.iterfind('{n}folders/{n}FolderInfo'.format(n=ns))])
+        return f
+
+    def _folders_from_data(self, folder, data, depth):
+        folders = []
+        if data is not None and 'FolderInfo' in data:
+            data = data['FolderInfo']
+            if not isinstance(data, list):
+                data = [data]
+            folders = [self._folder_tree_from_data(d, folder, depth) for d in data]
+        return self._folders_loaded(folder, folders)
+
+    def _folders_loaded(self, folder, folders):
+        folder._folders, folder._indexes = folders, {}
+        self._cache_folders(folder)
+        return folders
+
+    def _folders_request(self, folder, depth):
+        return self._token_data(['hamsterId', self.chomik_id], ['folderId', folder.folder_id], ['depth', depth])
+
+    def _load_folders(self, folder, depth=2):
+        self.logger.debug('Loading folders from folder {id} (depth {d})'.format(id=folder.folder_id, d=depth))
+        folders = [self._folder_tree_from_elem(e, folder, depth)
+                   for _, e in self._stream_action('Folders', self._folders_request(folder, depth), ['FolderInfo'])]
+        return self._folders_loaded(folder, folders)
+
+    def _cached_folders(self, folder):
+        if self.cache is not None:
+            cached = self.cache.get_folders(self.chomik_id, folder.folder_id)
+            if cached is not None:
+                folder._folders = [ChomikFolder.cache(self, name, folder_id, folder, hidden, adult, gallery_view, password)
+                                   for folder_id, name, hidden, adult, gallery_view, password in cached]
+                folder._indexes = {}
+
+    def folders_list(self, folder=None, refresh=False):
+        if folder is None:
+            folder = self
+        assert isinstance(folder, ChomikFolder)
+
+        if folder._folders is None and not refresh:
+            self._cached_folders(folder)
+        if refresh or folder._folders is None:
+            self._load_folders(folder)
+        return list(folder._folders)
 
-    def folders_list(self, folder=None):
+    def iter_folders(self, folder=None, refresh=False):
+        # generator variant of folders_list, folders are yielded as soon as they are parsed from response
+        # they are cached on folder only when whole listing was consumed
         if folder is None:
             folder = self
         assert isinstance(folder, ChomikFolder)
 
-        def folder_(data):
-            hidden = True if data['hidden'] == 'true' else False
-            adult = True if data['adult'] == 'true' else False
-            gallery_view = True if data['view']['gallery'] == 'true' else False
-            password = data['password'] if data['passwd'] == 'true' else None
-            return ChomikFolder.cache(self, data['name'], data['id'], folder, hidden, adult, gallery_view, password)
-
-        def folders_gen(data):
-            if 'FolderInfo' in data:
-                data = data['FolderInfo']
-                if isinstance(data, list):
-                    for f in data:
-                        yield folder_(f)
-                else:
-                    yield folder_(data)
+        if folder._folders is None and not refresh:
+            self._cached_folders(folder)
+        if not refresh and folder._folders is not None:
+            for f in list(folder._folders):
+                yield f
+            return
+
+        folders = []
+        self.logger.debug('Loading folders from folder {id} (depth {d})'.format(id=folder.folder_id, d=2))
+        for _, e in self._stream_action('Folders', self._folders_request(folder, 2), ['FolderInfo']):
+            f = self._folder_tree_from_elem(e, folder, 2)
+            folders.append(f)
+            yield f
+        self._folders_loaded(folder, folders)
+
+    def _open_file(self, file):
+        if file.downloadable:
+            return SeekableHTTPFile(file.url, file.name, self.sess, self.transport.timeout)
+
+    def _download_file(self, file, file_like, progress_callback, segments, rate_limiter, max_chunk_size, hashes, journal):
+        return ChomikDownloader(self, file, file_like, progress_callback, segments=segments, rate_limiter=rate_limiter,
+                                max_chunk_size=max_chunk_size, hashes=hashes, journal=journal)
 
-        a_data = OrderedDict([['token', self.__token], ['hamsterId', self.chomik_id], ['folderId', folder.folder_id], ['depth', 2]])
-        self.logger.debug('Loading folders from folder {id}'.format(id=folder.folder_id))
-        resp = self._send_action('Folders', a_data)
-        resp = resp['a:folder']['folders']
+    def _iter_folder(self, folder):
+        return chain(self.iter_folders(folder), self.iter_files(folder=folder))
 
-        return list(folders_gen(resp))
+    def _list(self, folder, only_downloadable):
+        return self.folders_list(folder) + self.files_list(only_downloadable, folder)
+
+    def _get_folder(self, folder, name, case_sensitive):
+        assert isinstance(name, ustr)
+        if folder._folders is None:
+            self.folders_list(folder)
+        return folder._lookup('_folders', name, case_sensitive)
+
+    def _get_file(self, folder, name, case_sensitive):
+        assert isinstance(name, ustr)
+        if folder._files is None:
+            folder._files = self.files_list(folder=folder)
+            folder._indexes = {}
+        return folder._lookup('_files', name, case_sensitive)
+
+    def _get(self, folder, name, case_sensitive):
+        assert isinstance(name, ustr)
+        found = self._get_folder(folder, name, case_sensitive)
+        if found is None:
+            found = self._get_file(folder, name, case_sensitive)
+        return found
+
+    def walk(self, top=None, topdown=True, max_depth=None, only_downloadable=False, prefetch=0):
+        # os.walk-like generator of (folder, folders, files), top may be folder or path
+        # with topdown folders list can be modified in place to skip some subfolders
+        # prefetch > 0 lists upcoming folders in background using so many threads
+        if top is None:
+            top = self
+        elif isinstance(top, ustr):
+            top = self.get_path(top)
+        assert isinstance(top, ChomikFolder)
+
+        def listing(folder):
+            return self.folders_list(folder), self.files_list(only_downloadable, folder)
+
+        executor = ThreadPoolExecutor(prefetch) if prefetch else None
+        prefetched = {}
+
+        def cancel(folder_ids):
+            # folders already being listed finish, but nothing waits for them
+            for folder_id in folder_ids:
+                future = prefetched.pop(folder_id, None)
+                if future is not None:
+                    future.cancel()
+
+        def visit(folder, depth):
+            future = prefetched.pop(folder.folder_id, None)
+            folders, files = future.result() if future is not None else listing(folder)
+            deeper = max_depth is None or depth < max_depth
+            if executor is not None and deeper:
+                for sub in folders:
+                    prefetched[sub.folder_id] = executor.submit(listing, sub)
+            return folders, files, deeper
+
+        def bottom_up(folder, depth):
+            folders, files, deeper = visit(folder, depth)
+            if deeper:
+                for sub in folders:
+                    for item in bottom_up(sub, depth + 1):
+                        yield item
+            yield folder, folders, files
+
+        try:
+            if topdown:
+                stack = [(top, 0)]
+                while stack:
+                    folder, depth = stack.pop()
+                    folders, files, deeper = visit(folder, depth)
+                    listed = list(folders)
+                    yield folder, folders, files
+                    if deeper:
+                        # prefetching of subtrees pruned by caller is cancelled
+                        cancel(set(sub.folder_id for sub in listed) - set(sub.folder_id for sub in folders))
+                        stack.extend((sub, depth + 1) for sub in reversed(folders))
+            else:
+                for item in bottom_up(top, 0):
+                    yield item
+        finally:
+            if executor is not None:
+                cancel(list(prefetched))
+                executor.shutdown(wait=False)
+
+    def crawl(self, root=None, workers=4, only_downloadable=False, attempts=3, max_pending=None):
+        # breadth-first listing of whole subtree using workers threads, yields (folder, files) as they complete
+        # at most max_pending (default 2 * workers) folders are listed ahead of consumer
+        # listing of folder is retried attempts times before exception is raised
+        if root is None:
+            root = self
+        elif isinstance(root, ustr):
+            root = self.get_path(root)
+        assert isinstance(root, ChomikFolder)
+        assert isinstance(workers, int) and workers > 0
+        if max_pending is None:
+            max_pending = 2 * workers
+
+        def listing(folder):
+            # free files are resolved later, together with other folders completed at the same time
+            files = self._cached_files(folder, False)
+            return self.folders_list(folder), (folder, files, None) if files is not None else (folder,) + self._list_files(folder)
+
+        # listings with free files wait until all folders which were being listed with them (their round) complete,
+        # then free files of all of them are resolved together
+        queue, running, errors, unresolved, round_left = deque([root]), {}, {}, [], set()
+        with ThreadPoolExecutor(workers) as executor:
+            while queue or running:
+                while queue and len(running) < max_pending:
+                    folder = queue.popleft()
+                    running[executor.submit(listing, folder)] = folder
+                listings = []
+                done = wait(running, return_when=FIRST_COMPLETED).done
+                round_left.difference_update(done)
+                for future in done:
+                    folder = running.pop(future)
+                    try:
+                        folders, files = future.result()
+                    except Exception as e:
+                        errors[folder.folder_id] = errors.get(folder.folder_id, 0) + 1
+                        if errors[folder.folder_id] >= attempts:
+                            raise
+                        self.logger.debug('Error {e} occurred during listing of folder {f}, retrying'.format(e=e, f=folder.folder_id))
+                        self.metrics.retry('crawl')
+                        queue.append(folder)
+                        continue
+                    queue.extend(folders)
+                    if files[2]:
+                        if not unresolved:
+                            round_left = set(running).difference(done)
+                        unresolved.append(files)
+                    else:
+                        listings.append(files)
+                if unresolved and not round_left:
+                    listings, unresolved = listings + unresolved, []
+                for (folder, _, _), files in zip(listings, self._resolve_listings(listings)):
+                    if only_downloadable:
+                        files = list(filter(lambda x: x.downloadable, files))
+                    yield folder, files
+
+    def load_tree(self, folder=None, depth=5):
+        if folder is None:
+            folder = self
+        assert isinstance(folder, ChomikFolder)
+        assert isinstance(depth, int) and depth >= 2
+
+        to_load = [folder]
+        while to_load:
+            f = to_load.pop()
+            self._load_folders(f, depth)
+            # folders at the edge of returned subtree need another request
+            stack = list(f._folders)
+            while stack:
+                sub = stack.pop()
+                if sub._folders is None:
+                    to_load.append(sub)
+                else:
+                    stack.extend(sub._folders)
+        return folder
 
     def get_path(self, path, case_sensitive=True):
         assert isinstance(path, ustr)
@@ -424,10 +1205,19 @@ class Chomik(ChomikFolder):
         assert isinstance(parent_folder, ChomikFolder)
 
         self.logger.debug('Creating new folder "{n}" in {f}'.format(n=name, f=parent_folder.folder_id))
-        data = OrderedDict([['token', self.__token], ['newFolderId', parent_folder.folder_id], ['name', name]])
+        data = self._token_data(['newFolderId', parent_folder.folder_id], ['name', name])
         data = self._send_action('AddFolder', data)
-
-        return ChomikFolder(self, name, data['a:folderId'], parent_folder, False, False, False, None)
+        return self._folder_added(name, data['a:folderId'], parent_folder)
+
+    def _folder_added(self, name, folder_id, parent_folder):
+        folder = ChomikFolder.cache(self, name, folder_id, parent_folder, False, False, False, None)
+        folder._folders = []
+        if parent_folder._folders is not None:
+            parent_folder._folders.append(folder)
+            parent_folder._indexes = {}
+        self._cache_folders(parent_folder)
+        self._cache_folders(folder)
+        return folder
 
     def rename_folder(self, name, folder):
         assert isinstance(name, ustr)
@@ -436,9 +1226,15 @@ class Chomik(ChomikFolder):
         assert isinstance(folder, ChomikFolder)
 
         self.logger.debug('Renaming folder {f} to {n}'.format(f=folder.folder_id, n=name))
-        data = OrderedDict([['token', self.__token], ['folderId', folder.folder_id], ['name', name]])
+        data = self._token_data(['folderId', folder.folder_id], ['name', name])
         self._send_action('RenameFolder', data)
-        folder.name = name
+        self._folder_renamed(folder, name)
+
+    def _folder_renamed(self, folder, name):
+        folder.name = self._intern(name)
+        self._paths_changed()
+        folder.parent_folder._indexes = {}
+        self._cache_folders(folder.parent_folder)
 
     def move_folder(self, folder, to):
         if isinstance(folder, Chomik):
@@ -447,9 +1243,19 @@ class Chomik(ChomikFolder):
         assert isinstance(folder, ChomikFolder)
 
         self.logger.debug('Moving folder {f} to {tf}'.format(f=folder.folder_id, tf=to.folder_id))
-        data = OrderedDict([['token', self.__token], ['folderId', folder.folder_id], ['newFolderId', to.folder_id]])
+        data = self._token_data(['folderId', folder.folder_id], ['newFolderId', to.folder_id])
         self._send_action('MoveFolder', data)
+        self._folder_moved(folder, to)
+
+    def _folder_moved(self, folder, to):
+        folder.parent_folder._forget_child(folder)
+        if to._folders is not None:
+            to._folders.append(folder)
+            to._indexes = {}
+        self._cache_folders(folder.parent_folder)
+        self._cache_folders(to)
         folder.parent_folder = to
+        self._paths_changed()
 
     def remove_folder(self, folder, force=False):
         assert isinstance(force, bool)
@@ -458,8 +1264,15 @@ class Chomik(ChomikFolder):
         assert isinstance(folder, ChomikFolder)
 
         self.logger.debug('Removing folder {f}'.format(f=folder.folder_id))
-        data = OrderedDict([['token', self.__token], ['folderId', folder.folder_id], ['force', int(force)]])
+        data = self._token_data(['folderId', folder.folder_id], ['force', int(force)])
         self._send_action('RemoveFolder', data)
+        self._folder_removed(folder)
+
+    def _folder_removed(self, folder):
+        folder.parent_folder._forget_child(folder)
+        self._cache_folders(folder.parent_folder)
+        if self.cache is not None:
+            self.cache.invalidate(self.chomik_id, folder.folder_id)
         folder.parent_folder = None
         del(self._folder_cache[folder.folder_id])
 
@@ -469,12 +1282,83 @@ class Chomik(ChomikFolder):
         assert isinstance(folder, ChomikFolder)
         assert isinstance(params, dict)
 
-        data = OrderedDict([
-            ('token', self.__token),
-            ('folderId', folder.folder_id)
-        ])
+        return self._folder_modified(folder, self._send_action('ModifyFolder', self._modify_folder_data(folder, params)))
+
+    def _modify_folder_data(self, folder, params):
+        data = self._token_data(['folderId', folder.folder_id])
         data.update(params)
-        return self._send_action('ModifyFolder', data)
+        return data
+
+    def _folder_modified(self, folder, data):
+        # folder attributes are updated from returned details, so cached folders stay consistent with server
+        details = data.get('a:folderDetails') if isinstance(data, dict) else None
+        if isinstance(details, dict):
+            if 'hidden' in details:
+                folder.hidden = details['hidden'] == 'true'
+            if 'adult' in details:
+                folder.adult = details['adult'] == 'true'
+            if isinstance(details.get('view'), dict) and 'gallery' in details['view']:
+                folder.gallery_view = details['view']['gallery'] == 'true'
+            if 'passwd' in details:
+                folder.password = details.get('password') if details['passwd'] == 'true' else None
+            self._cache_folders(folder.parent_folder)
+        return data
+
+    def _bulk(self, items, request, apply, workers):
+        # requests of items are sent by workers threads, results are applied (and local caches updated) in calling
+        # thread in order of items, returns list of results with exception instead of result of failed items
+        assert isinstance(workers, int) and workers > 0
+        results = []
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(request, item) for item in items]
+            for item, future in zip(items, futures):
+                try:
+                    results.append(apply(item, future.result()))
+                except Exception as e:
+                    self.logger.debug('Error {e} occurred during bulk operation on {i}'.format(e=e, i=item))
+                    results.append(e)
+        return results
+
+    def move_folders(self, folders, to, workers=8):
+        # returns list of True or exception for every folder
+        folders = list(folders)
+        for folder in folders:
+            if isinstance(folder, Chomik):
+                raise UnsupportedOperation
+            assert isinstance(folder, ChomikFolder)
+        assert isinstance(to, ChomikFolder)
+
+        self.logger.debug('Moving {c} folders to {tf}'.format(c=len(folders), tf=to.folder_id))
+        return self._bulk(folders, lambda folder: self._send_action('MoveFolder', self._token_data(
+            ['folderId', folder.folder_id], ['newFolderId', to.folder_id])),
+            lambda folder, data: self._folder_moved(folder, to) or True, workers)
+
+    def remove_folders(self, folders, force=False, workers=8):
+        # returns list of True or exception for every folder
+        assert isinstance(force, bool)
+        folders = list(folders)
+        for folder in folders:
+            if isinstance(folder, Chomik):
+                raise UnsupportedOperation
+            assert isinstance(folder, ChomikFolder)
+
+        self.logger.debug('Removing {c} folders'.format(c=len(folders)))
+        return self._bulk(folders, lambda folder: self._send_action('RemoveFolder', self._token_data(
+            ['folderId', folder.folder_id], ['force', int(force)])),
+            lambda folder, data: self._folder_removed(folder) or True, workers)
+
+    def modify_folders(self, folders, params, workers=8):
+        # same params applied to all folders, returns list of responses (see modify_folder) or exceptions
+        folders = list(folders)
+        for folder in folders:
+            if isinstance(folder, Chomik):
+                raise UnsupportedOperation
+            assert isinstance(folder, ChomikFolder)
+        assert isinstance(params, dict)
+
+        self.logger.debug('Modifying {c} folders'.format(c=len(folders)))
+        return self._bulk(folders, lambda folder: self._send_action('ModifyFolder', self._modify_folder_data(folder, params)),
+                          self._folder_modified, workers)
 
     def set_folder_hidden(self, folder, hidden):
         assert isinstance(hidden, bool)
@@ -542,8 +1426,12 @@ class Chomik(ChomikFolder):
             'Description': description
         }
         resp = self._send_web_action('FileDetails/EditNameAndDescAction', data)
+        return self._file_renamed(file, name, resp)
+
+    def _file_renamed(self, file, name, resp):
         if resp and resp['IsSuccess']:
-            file.name = name + os.path.splitext(file.name)[1]
+            file.name = self._intern(name + os.path.splitext(file.name)[1])
+            self._files_changed(file.parent_folder)
             return True
         return False
 
@@ -552,14 +1440,22 @@ class Chomik(ChomikFolder):
         assert isinstance(to_folder, ChomikFolder)
 
         self.logger.debug('Moving file {f} to {tf}'.format(f=file.file_id, tf=to_folder.folder_id))
-        data = {
+        resp = self._send_web_action('FileDetails/MoveFileAction', self._file_action_data(file, to_folder.folder_id))
+        return self._file_moved(file, to_folder, resp)
+
+    def _file_action_data(self, file, folder_to):
+        # folder_to is 0 for removal
+        return {
             'ChomikName': self.name,
             'FolderId': file.parent_folder.folder_id,
             'FileId':   file.file_id,
-            'FolderTo': to_folder.folder_id
+            'FolderTo': folder_to
         }
-        resp = self._send_web_action('FileDetails/MoveFileAction', data)
+
+    def _file_moved(self, file, to_folder, resp):
         if resp and resp['IsSuccess']:
+            self._files_changed(file.parent_folder)
+            self._files_changed(to_folder)
             file.parent_folder = to_folder
             return True
         return False
@@ -568,19 +1464,44 @@ class Chomik(ChomikFolder):
         assert isinstance(file, ChomikFile)
 
         self.logger.debug('Removing file {f}'.format(f=file.file_id))
-        data = {
-            'ChomikName': self.name,
-            'FolderId': file.parent_folder.folder_id,
-            'FileId':   file.file_id,
-            'FolderTo': 0
-        }
-        resp = self._send_web_action('FileDetails/DeleteFileAction', data)
+        resp = self._send_web_action('FileDetails/DeleteFileAction', self._file_action_data(file, 0))
+        return self._file_removed(file, resp)
+
+    def _file_removed(self, file, resp):
         if resp and resp['IsSuccess']:
+            self._files_changed(file.parent_folder)
             del file
             return True
         return False
 
-    def upload_file(self, file_like_obj, name=None, progress_callback=None, folder=None):
+    def move_files(self, files, to_folder, workers=8):
+        # returns list of results of move_file (or exceptions) for every file
+        files = list(files)
+        for file in files:
+            assert isinstance(file, ChomikFile)
+        assert isinstance(to_folder, ChomikFolder)
+
+        self.logger.debug('Moving {c} files to {tf}'.format(c=len(files), tf=to_folder.folder_id))
+        return self._bulk(files, lambda file: self._send_web_action('FileDetails/MoveFileAction',
+                                                                    self._file_action_data(file, to_folder.folder_id)),
+                          lambda file, resp: self._file_moved(file, to_folder, resp), workers)
+
+    def remove_files(self, files, workers=8):
+        # returns list of results of remove_file (or exceptions) for every file
+        files = list(files)
+        for file in files:
+            assert isinstance(file, ChomikFile)
+
+        self.logger.debug('Removing {c} files'.format(c=len(files)))
+        return self._bulk(files, lambda file: self._send_web_action('FileDetails/DeleteFileAction', self._file_action_data(file, 0)),
+                          self._file_removed, workers)
+
+    def upload_file(self, file_like_obj, name=None, progress_callback=None, folder=None, hashes=None, journal=None):
+        # with journal upload session of local file is saved there, unfinished upload of same file
+        # (same size and mtime) to same folder is continued instead of starting new one
+        # file_like_obj can be also non-seekable file (pipe) or iterator of bytes, up to upload_replay_size bytes
+        # of such stream are read ahead, if it ends there it's uploaded from memory, else ChomikStreamUploader
+        # sends it as it's read, without journal
         if name is None:
             name = file_like_obj.name
         if folder is None:
@@ -590,20 +1511,60 @@ class Chomik(ChomikFolder):
         assert isinstance(name, ustr)
         assert isinstance(folder, ChomikFolder)
 
-        self.logger.debug('Getting file upload data for file "{n}" in folder {f}'.format(n=name, f=folder.folder_id))
-        data = OrderedDict([['token', self.__token], ['folderId', folder.folder_id], ['fileName', name]])
-        data = self._send_action('UploadToken', data)
+        assert isinstance(journal, UploadJournal) or journal is None
+
+        stream = None
+        if not self._seekable(file_like_obj):
+            stream = StreamBuffer(file_like_obj, self.upload_replay_size)
+            if stream.fill(self.upload_replay_size):
+                file_like_obj, stream = io.BytesIO(stream.read()), None
+            else:
+                journal = None
+
+        session = journal.find(file_like_obj, self.chomik_id, folder.folder_id, name) if journal is not None else None
+        if session is not None:
+            key, stamp, server = session
+            self.logger.debug('Upload data for file "{n}" in folder {f} found in journal'.format(n=name, f=folder.folder_id))
+        else:
+            key, stamp, server = self._upload_token(name, folder)
+            if journal is not None:
+                journal.add(file_like_obj, self.chomik_id, folder.folder_id, name, key, stamp, server)
+        self._files_changed(folder)
+
+        if stream is not None:
+            return ChomikStreamUploader(self, folder, stream, name, server, key, stamp, progress_callback, hashes=hashes)
+        uploader = ChomikUploader(self, folder, file_like_obj, name, server, key, stamp, progress_callback, hashes=hashes,
+                                  journal=journal)
+        uploader.continued = session is not None
+        return uploader
 
-        key, stamp, server = data['a:key'], data['a:stamp'], data['a:server']
+    @staticmethod
+    def _seekable(file):
+        if not all(hasattr(file, attr) for attr in ('read', 'tell', 'seek')):
+            return False
+        if hasattr(file, 'seekable') and not file.seekable():
+            return False
+        return total_len(file) is not None
 
-        return ChomikUploader(self, folder, file_like_obj, name, server, key, stamp, progress_callback)
+    def _upload_token(self, name, folder):
+        self.logger.debug('Getting file upload data for file "{n}" in folder {f}'.format(n=name, f=folder.folder_id))
+        data = self._token_data(['folderId', folder.folder_id], ['fileName', name])
+        data = self._send_action('UploadToken', data)
+        return data['a:key'], data['a:stamp'], data['a:server']
 
 
 class ChomikUploader(object):
     class UploadPaused(Exception):
         pass
 
-    def __init__(self, chomik, folder, file, name, server, key, stamp, progress_callback=None):
+    class UploadStalled(Exception):
+        pass
+
+    def __init__(self, chomik, folder, file, name, server, key, stamp, progress_callback=None, rate_limiter=None, hashes=None,
+                 journal=None):
+        # rate_limiter limits this upload only, chomik.upload_limiter applies too
+        # hashes - names of hashlib algorithms computed over file while it's sent, see hexdigests
+        # journal - UploadJournal with this upload session, its entry is removed when upload finishes
         assert hasattr(file, 'read') and hasattr(file, 'tell') and hasattr(file, 'seek')
         assert isinstance(folder, ChomikFolder)
         assert callable(progress_callback)
@@ -612,24 +1573,173 @@ class ChomikUploader(object):
         assert isinstance(server, ustr)
         assert isinstance(key, ustr)
         assert isinstance(stamp, ustr)
+        assert isinstance(rate_limiter, RateLimiter) or rate_limiter is None
+        assert isinstance(journal, UploadJournal) or journal is None
 
         self.chomik, self.folder, self.file, self.name = chomik, folder, file, name
         self.server, self.key, self.stamp = server, key, stamp
         self.paused, self.finished, self.started = False, False, False
+        # session restored from journal, so start continues from part of file already on server
+        self.journal, self.continued = journal, False
         self.upload_size, self.bytes_uploaded = total_len(file), 0
-        self.__start_pos, self.__part_size = 0, self.upload_size
+        self._start_pos, self._part_size = 0, self.upload_size
         self.progress_callback = progress_callback
+        self.rate_limiter = rate_limiter
+        # monitor of current request and its bytes already passed to rate limiters
+        self._monitor, self._monitor_read = None, 0
+        # bytes of file [0, _hashed) are already hashed
+        self.hashers, self._hashed = new_hashers(hashes), 0
+        # stall_timeout - seconds, request is dropped and upload resumed from offset reported by server when less than
+        # min_speed bytes/s were sent during last stall_timeout seconds (or nothing at all could be sent for so long)
+        # read_ahead - bytes of file read ahead by background thread while previous ones are sent, None to disable
+        self.stall_timeout, self.min_speed = chomik.upload_stall_timeout, chomik.upload_min_speed
+        self.read_ahead, self._reader = chomik.upload_read_ahead, None
+        # (clock, bytes_uploaded) of current request from last stall_timeout seconds, clock doesn't count seconds
+        # spent waiting for rate limiters (_throttled)
+        self._samples, self._throttled = deque(), 0
 
-    def __callback(self, monitor):
-        self.bytes_uploaded = self.__start_pos + (monitor.bytes_read - (monitor.len - self.__part_size))
+    @property
+    def hexdigests(self):
+        return dict((name, h.hexdigest()) for name, h in dict_iteritems(self.hashers))
+
+    def _hash_read(self, pos, data):
+        # file parts sent again after resume are not hashed twice
+        end = pos + len(data)
+        if pos <= self._hashed < end:
+            data = memoryview(data)[self._hashed - pos:]
+            for h in self.hashers.values():
+                h.update(data)
+            self._hashed = end
+
+    def _hash_prefix(self, end):
+        # hashes part of file which server already has, but wasn't hashed here (e.g. it was sent by other process)
+        pos = self.file.tell()
+        self.file.seek(self._hashed)
+        while self._hashed < end:
+            data = self.file.read(min(end - self._hashed, 2 ** 20))
+            if not data:
+                break
+            self._hash_read(self._hashed, data)
+        self.file.seek(pos)
+
+    def _throttle(self, amount):
+        # called from inside of monitor read, so sleeping here slows down sending
+        delay = reserve(amount, self.rate_limiter, self.chomik.upload_limiter)
+        if delay > 0:
+            time.sleep(delay)
+            self._throttled += delay
+
+    def _check_stall(self):
+        if not self.stall_timeout:
+            return
+        now = clock() - self._throttled
+        self._samples.append((now, self.bytes_uploaded))
+        # oldest kept sample is at least stall_timeout old
+        while len(self._samples) > 1 and self._samples[1][0] <= now - self.stall_timeout:
+            self._samples.popleft()
+        since, uploaded = self._samples[0]
+        if now - since >= self.stall_timeout and self.bytes_uploaded - uploaded < self.min_speed * (now - since):
+            raise self.UploadStalled('Sent {b} bytes in last {s:.1f} s'.format(b=self.bytes_uploaded - uploaded, s=now - since))
+
+    def _callback(self, monitor):
+        if monitor is not self._monitor:
+            self._monitor, self._monitor_read = monitor, 0
+            self._samples.clear()
+        self._throttle(monitor.bytes_read - self._monitor_read)
+        self._monitor_read = monitor.bytes_read
+        self.bytes_uploaded = self._start_pos + (monitor.bytes_read - (monitor.len - self._part_size))
         if self.progress_callback is not None:
             self.progress_callback(self)
         if self.paused:
             raise self.UploadPaused
+        self._check_stall()
 
     def pause(self):
         self.paused = True
 
+    # errors of resumed session restored from journal meaning that server doesn't know it (anymore), e.g. it expired
+    # (error response of upload, or resume check without file size)
+    stale_session_errors = (UploadException, KeyError, TypeError, ValueError)
+
+    def _new_session(self, session):
+        # replaces session restored from journal by new one (key, stamp, server), upload starts from beginning
+        self.key, self.stamp, self.server = session
+        if self.journal is not None:
+            self.journal.add(self.file, self.chomik.chomik_id, self.folder.folder_id, self.name, self.key, self.stamp,
+                             self.server)
+        self.continued, self.bytes_uploaded = False, 0
+        self.hashers, self._hashed = new_hashers(list(self.hashers)), 0
+        self.file.seek(0)
+
+    def _fields(self, file, resume_from=None):
+        data = OrderedDict([['chomik_id', ustr(self.chomik.chomik_id)], ['folder_id', ustr(self.folder.folder_id)],
+                            ['key', self.key], ['time', self.stamp]])
+        if resume_from is not None:
+            data['resume_from'] = ustr(resume_from)
+        data['client'], data['locale'], data['file'] = 'ChomikBox-'+CHOMIKBOX_VERSION, 'PL', (self.name, file)
+        return data
+
+    def _request(self, resume_from=None):
+        # body and headers of upload request, starting at resume_from when resumed
+        if resume_from is None:
+            fields = self._fields(self._start_part())
+        else:
+            fields = self._fields(self._resume_part(resume_from), resume_from)
+        monitor = MultipartEncoderMonitor.from_fields(fields=fields, callback=self._callback)
+        return monitor, {'Content-Type': monitor.content_type, 'User-Agent': 'Mozilla/5.0'}
+
+    def _post(self, data, headers):
+        started = clock()
+        timeout = self.chomik.transport.upload_timeout
+        if self.stall_timeout:
+            # while body is sent, socket uses connect timeout
+            timeout = (self.stall_timeout, timeout[1])
+        try:
+            # 's' if self.chomik.ssl else ''
+            return self.chomik.sess.post('http://{server}/file/'.format(server=self.server), data=data, headers=headers,
+                                         timeout=timeout)
+        finally:
+            self._close_reader()
+            self.chomik.metrics.transfer('upload', max(self.bytes_uploaded - self._start_pos, 0), clock() - started)
+
+    def _start_part(self):
+        # file is wrapped only when it has to be hashed or read ahead
+        return self._resume_part(0) if self.hashers or self.read_ahead else self.file
+
+    def _resume_part(self, resume_from):
+        self._close_reader()
+        if self.hashers and self._hashed < resume_from:
+            self._hash_prefix(resume_from)
+        part = PartFile(self.file, resume_from, self._hash_read if self.hashers else None)
+        self._start_pos = resume_from
+        self._part_size = part.len
+        if self.read_ahead:
+            # hashing is done by reading thread too
+            part = self._reader = ReadAheadFile(part, part.len, self.read_ahead, min(2 ** 16, self.read_ahead),
+                                                min(2 ** 20, self.read_ahead))
+        return part
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def _upload_result(self, content):
+        resp = xmltodict.parse(content)['resp']
+        if resp['@res'] != '1':
+            if '@errorMessage' in resp:
+                raise UploadException(resp['@res'], resp['@errorMessage'])
+            else:
+                raise UploadException(resp['@res'])
+        if '@fileid' not in resp:
+            raise UploadException
+
+        self.finished = True
+        self.chomik._files_changed(self.folder)
+        if self.journal is not None:
+            self.journal.remove(self.file, self.chomik.chomik_id, self.folder.folder_id, self.name)
+        return resp['@fileid']
+
     def start(self, attempts=0):
         # attempts = -1 for infinite
         assert isinstance(attempts, int)
@@ -640,16 +1750,19 @@ class ChomikUploader(object):
             raise UploadException('Tried to start already started upload')
         self.started = True
 
-        data = OrderedDict([['chomik_id', ustr(self.chomik.chomik_id)], ['folder_id', ustr(self.folder.folder_id)],
-                            ['key', self.key], ['time', self.stamp], ['client', 'ChomikBox-'+CHOMIKBOX_VERSION], ['locale', 'PL'],
-                            ['file', (self.name, self.file)]])
-        monitor = MultipartEncoderMonitor.from_fields(fields=data, callback=self.__callback)
-        headers = {'Content-Type': monitor.content_type, 'User-Agent': 'Mozilla/5.0'}
-
         # 's' if self.chomik.ssl else ''
         try:
+            if self.continued:
+                self.chomik.logger.debug('Continuing upload of file "{n}" from journal'.format(n=self.name))
+                try:
+                    return self.resume()
+                except self.stale_session_errors as e:
+                    self.chomik.logger.debug('Upload session of file "{n}" from journal failed ({e}), starting new one'.format(
+                        n=self.name, e=e))
+                    self._new_session(self.chomik._upload_token(self.name, self.folder))
+            data, headers = self._request()
             self.chomik.logger.debug('Started uploading file "{n}" to folder {f}'.format(n=self.name, f=self.folder.folder_id))
-            resp = self.chomik.sess.post('http://{server}/file/'.format(server=self.server), data=monitor, headers=headers)
+            resp = self._post(data, headers)
         except Exception as e:
             if isinstance(e, self.UploadPaused):
                 self.chomik.logger.debug('Upload of file "{n}" paused'.format(n=self.name))
@@ -660,6 +1773,7 @@ class ChomikUploader(object):
                 while attempts == -1 or attempts >= attempt:
                     try:
                         self.chomik.logger.debug('Resuming failed upload of file "{n}"'.format(n=self.name))
+                        self.chomik.metrics.retry('upload')
                         return self.resume()
                     except Exception as ex:
                         e = ex
@@ -669,17 +1783,7 @@ class ChomikUploader(object):
                     raise e
         else:
             self.chomik.logger.debug('Upload of file "{n}" finished'.format(n=self.name))
-            resp = xmltodict.parse(resp.content)['resp']
-            if resp['@res'] != '1':
-                if '@errorMessage' in resp:
-                    raise UploadException(resp['@res'], resp['@errorMessage'])
-                else:
-                    raise UploadException(resp['@res'])
-            if '@fileid' not in resp:
-                raise UploadException
-
-            self.finished = True
-            return resp['@fileid']
+            return self._upload_result(resp.content)
 
     def resume(self):
         if self.finished:
@@ -690,77 +1794,521 @@ class ChomikUploader(object):
 
         # 's' if self.chomik.ssl else ''
         # TODO: find workaround for SSL handshake
-        resp = self.chomik.sess.get('http://{server}/resume/check/?key={key}'.format(server=self.server, key=self.key), headers=headers)
+        resp = self.chomik.sess.get('http://{server}/resume/check/?key={key}'.format(server=self.server, key=self.key), headers=headers,
+                                    timeout=self.chomik.transport.timeout)
         resp = xmltodict.parse(resp.content)['resp']
 
         resume_from = int(resp['@file_size'])
-        part = PartFile(self.file, resume_from)
-        self.__start_pos = resume_from
-        self.__part_size = part.len
-
-        data = OrderedDict([['chomik_id', ustr(self.chomik.chomik_id)], ['folder_id', ustr(self.folder.folder_id)],
-                            ['key', self.key], ['time', self.stamp], ['resume_from', ustr(resume_from)],
-                            ['client', 'ChomikBox-'+CHOMIKBOX_VERSION], ['locale', 'PL'], ['file', (self.name, part)]])
-        monitor = MultipartEncoderMonitor.from_fields(fields=data, callback=self.__callback)
-        headers = {'Content-Type': monitor.content_type, 'User-Agent': 'Mozilla/5.0'}
+        data, headers = self._request(resume_from)
 
         self.chomik.logger.debug('Resumed uploading file "{n}" to folder {f} from {b} bytes'.format(n=self.name, f=self.folder.folder_id, b=resume_from))
         try:
-            # 's' if self.chomik.ssl else ''
-            resp = self.chomik.sess.post('http://{server}/file/'.format(server=self.server), data=monitor, headers=headers)
+            resp = self._post(data, headers)
         except self.UploadPaused:
             self.chomik.logger.debug('Upload of file "{n}" paused'.format(n=self.name))
             return 'paused'
         else:
             self.chomik.logger.debug('Upload of file "{n}" finished'.format(n=self.name))
+            return self._upload_result(resp.content)
 
-            resp = xmltodict.parse(resp.content)['resp']
-            if resp['@res'] != '1':
-                if '@errorMessage' in resp:
-                    raise UploadException(resp['@res'], resp['@errorMessage'])
-                else:
-                    raise UploadException(resp['@res'])
-            if '@fileid' not in resp:
-                raise UploadException
 
-            self.finished = True
-            return resp['@fileid']
+class ChomikStreamUploader(ChomikUploader):
+    # uploader of StreamBuffer (stream of unknown length), body is sent with chunked transfer encoding as stream is read
+    # failed upload can be resumed only from part of stream still kept in its replay buffer
+    # upload_size is None until whole stream is sent
+    def __init__(self, chomik, folder, stream, name, server, key, stamp, progress_callback=None, rate_limiter=None, hashes=None,
+                 chunk_size=65536):
+        assert isinstance(stream, StreamBuffer)
+        assert isinstance(chunk_size, int) and chunk_size > 0
+        ChomikUploader.__init__(self, chomik, folder, stream, name, server, key, stamp, progress_callback, rate_limiter, hashes)
+        self.chunk_size = chunk_size
+
+    def _request(self, resume_from=None):
+        try:
+            self.file.seek(resume_from or 0)
+        except IOError:
+            raise UploadException('Upload of stream can\'t be resumed from {r} bytes, only data from {b} bytes is buffered'.format(
+                r=resume_from, b=self.file.buffered_from))
+        self._start_pos = self.bytes_uploaded = resume_from or 0
+        self._samples.clear()
+        # multipart body with empty file is split around file contents
+        encoder = MultipartEncoder(fields=self._fields(b'', resume_from))
+        body = encoder.to_string()
+        trailer = '\r\n--{}--\r\n'.format(encoder.boundary_value).encode('ascii')
+        assert body.endswith(trailer)
+        return self._body(body[:-len(trailer)], trailer), {'Content-Type': encoder.content_type, 'User-Agent': 'Mozilla/5.0'}
+
+    def _body(self, head, trailer):
+        yield head
+        while True:
+            pos = self.file.tell()
+            data = self.file.read(self.chunk_size)
+            if not data:
+                break
+            self._throttle(len(data))
+            if self.hashers:
+                self._hash_read(pos, data)
+            self.bytes_uploaded = pos + len(data)
+            if self.progress_callback is not None:
+                self.progress_callback(self)
+            if self.paused:
+                raise self.UploadPaused
+            self._check_stall()
+            yield data
+        self.upload_size = self.bytes_uploaded
+        yield trailer
+
+
+class ChomikUploadManager(object):
+    class Job(object):
+        def __init__(self, file, name, folder):
+            self.file, self.name, self.folder = file, name, folder
+            # queued -> ready -> uploading -> done / paused / failed
+            self.state, self.uploader, self.file_id, self.error = 'queued', None, None, None
+
+        def __repr__(self):
+            return '<ChomikBox.ChomikUploadManager.Job: "{n}" {s}>'.format(n=self.name, s=self.state)
+
+        @property
+        def bytes_uploaded(self):
+            return self.uploader.bytes_uploaded if self.uploader is not None else 0
+
+    def __init__(self, chomik, workers=4, attempts=3, prefetch=None, progress_callback=None, journal=None):
+        # prefetch - how many upload tokens are fetched ahead of running uploads (default: workers)
+        # journal - UploadJournal, unfinished uploads of same local files are continued
+        assert isinstance(chomik, Chomik)
+        assert isinstance(workers, int) and workers > 0
+        assert isinstance(attempts, int)
+        assert callable(progress_callback) or progress_callback is None
+        assert isinstance(journal, UploadJournal) or journal is None
+
+        self.chomik, self.workers, self.attempts, self.journal = chomik, workers, attempts, journal
+        self.prefetch = workers if prefetch is None else prefetch
+        self.progress_callback = progress_callback
+        self.jobs, self.started_at = [], None
+        self._lock = threading.Lock()
+
+    def add(self, file_like_obj, name=None, folder=None):
+        if name is None:
+            name = file_like_obj.name
+        if folder is None:
+            folder = self.chomik
+        assert isinstance(name, ustr)
+        assert isinstance(folder, ChomikFolder)
+
+        job = self.Job(file_like_obj, name, folder)
+        self.jobs.append(job)
+        return job
+
+    @property
+    def upload_size(self):
+        # streams of unknown length are not counted
+        return sum(filter(None, (total_len(job.file) for job in self.jobs)))
+
+    @property
+    def bytes_uploaded(self):
+        return sum(job.bytes_uploaded for job in self.jobs)
+
+    @property
+    def speed(self):
+        # average bytes/s since start
+        if self.started_at is None:
+            return 0
+        return self.bytes_uploaded / max(time.time() - self.started_at, 1e-6)
+
+    def pause(self):
+        for job in self.jobs:
+            if job.uploader is not None:
+                job.uploader.pause()
+
+    def __callback(self, job):
+        def callback(uploader):
+            if self.progress_callback is not None:
+                with self._lock:
+                    self.progress_callback(self, job)
+        return callback
+
+    def __run(self, job):
+        job.state = 'uploading'
+        try:
+            if job.uploader.started:
+                res = job.uploader.resume()
+            else:
+                res = job.uploader.start(self.attempts)
+        except Exception as e:
+            self.chomik.logger.debug('Upload of file "{n}" failed: {e}'.format(n=job.name, e=e))
+            job.state, job.error = 'failed', e
+        else:
+            if res == 'paused':
+                job.state = 'paused'
+            else:
+                job.state, job.file_id = 'done', res
+        return job
+
+    def start(self):
+        # blocks until every job is done, paused or failed, returns list of jobs
+        self.started_at = time.time()
+        with ThreadPoolExecutor(self.workers) as executor:
+            running = set()
+            for job in self.jobs:
+                if job.state == 'done':
+                    continue
+                while len(running) >= self.workers + self.prefetch:
+                    running = wait(running, return_when=FIRST_COMPLETED).not_done
+                if job.uploader is None:
+                    # upload token is fetched here, while workers are busy uploading
+                    try:
+                        job.uploader = self.chomik.upload_file(job.file, job.name, self.__callback(job), job.folder,
+                                                               journal=self.journal)
+                    except Exception as e:
+                        job.state, job.error = 'failed', e
+                        continue
+                job.state = 'ready'
+                running.add(executor.submit(self.__run, job))
+            wait(running)
+        return self.jobs
 
 
 class ChomikDownloader(object):
-    def __init__(self, chomik, chomik_file, save_file, progress_callback=None, chunk_size=8192):
+    def __init__(self, chomik, chomik_file, save_file, progress_callback=None, chunk_size=8192, segments=1, rate_limiter=None,
+                 max_chunk_size=None, hashes=None, journal=None):
+        # segments > 1 downloads byte ranges in parallel, save_file has to be seekable then
+        # rate_limiter limits this download only (all segments together), chomik.download_limiter applies too
+        # save_file can be also mmap, bytearray or memoryview of file size, data is written straight into it then
+        # with max_chunk_size data is read with readinto into one reused buffer, read size starts at chunk_size
+        # and grows up to max_chunk_size while reads come full
+        # hashes - names of hashlib algorithms computed over data while it's downloaded, see hexdigests
+        # segments written ahead of hashed position are read back from save_file, so it has to be readable then
+        # journal - DownloadJournal or its path, download continues from offsets saved there if they match this file
+        # and end of each downloaded range matches server data, save_file has to be opened for reading and writing
+        # without truncating (r+b) then, journal is removed when download finishes
         assert isinstance(chomik, Chomik)
         assert isinstance(chomik_file, ChomikFile)
-        assert hasattr(save_file, 'write')
+        assert hasattr(save_file, 'write') or isinstance(save_file, (mmap.mmap, bytearray, memoryview))
         assert isinstance(chunk_size, int)
+        assert max_chunk_size is None or isinstance(max_chunk_size, int) and max_chunk_size >= chunk_size
+        assert isinstance(segments, int) and segments >= 1
+        assert isinstance(rate_limiter, RateLimiter) or rate_limiter is None
+        assert isinstance(journal, (DownloadJournal, ustr, str)) or journal is None
         assert chomik_file.downloadable
 
         self.chomik, self.chomik_file, self.save_file, self.chunk_size = chomik, chomik_file, save_file, chunk_size
+        self.max_chunk_size = max_chunk_size
         self.paused, self.finished, self.started, self.bytes_downloaded = False, False, False, 0
-        self.download_size = int(self.chomik.sess.head(chomik_file.url).headers["Content-Length"])
+        head = self.chomik.sess.head(chomik_file.url, headers={'Range': 'bytes=0-'}, timeout=self.chomik.transport.timeout)
+        self.download_size = int(head.headers["Content-Length"])
         self.progress_callback = progress_callback
+        self.rate_limiter = rate_limiter
+        self._lock, self._write_lock = threading.Lock(), threading.Lock()
+        # bytes [0, _hashed) are already hashed
+        self.hashers, self._hashed, self._hash_lock = new_hashers(hashes), 0, threading.Lock()
+
+        # [start, end, position] of every byte range
+        self.segments = []
+        if segments > 1 and head.status_code == 206 and self.download_size > 0:
+            part = -(-self.download_size // segments)
+            self.segments = [[start, min(start + part, self.download_size), start]
+                             for start in range(0, self.download_size, part)]
+
+        self._target = None
+        if isinstance(save_file, (mmap.mmap, bytearray, memoryview)):
+            self._target = memoryview(save_file)
+            assert len(self._target) >= self.download_size
+        elif self.segments:
+            assert hasattr(save_file, 'seek')
+            if self.hashers and not readable(save_file):
+                raise ValueError('save_file has to be readable (e.g. opened "w+b") to hash download with segments, '
+                                 'segments written ahead of hashed position are read back from it')
+
+        self._fileno = None
+        if self.segments and self._target is None and hasattr(os, 'pwrite'):
+            try:
+                save_file.flush()
+                self._fileno = save_file.fileno()
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+            else:
+                # whole file is allocated up front, so segments don't fragment it
+                if hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(self._fileno, 0, self.download_size)
+                    except OSError:
+                        pass
+
+        self.journal = DownloadJournal(journal) if isinstance(journal, (ustr, str)) else journal
+        self._journal_saved = 0
+        if self.journal is not None:
+            self.__restore()
+
+    # bytes compared with server at end of every downloaded range before download is continued from journal
+    journal_check_size = 4096
 
     @property
     def name(self):
         return self.chomik_file.name
 
+    @staticmethod
+    def __valid_segments(segments, size):
+        if not isinstance(segments, list) or not segments:
+            return False
+        expected = 0
+        for segment in segments:
+            if not isinstance(segment, list) or len(segment) != 3 or not all(isinstance(x, int) for x in segment):
+                return False
+            start, end, pos = segment
+            if start != expected or not start <= pos <= end:
+                return False
+            expected = end
+        return expected == size
+
+    def __local_size(self):
+        if self._target is not None:
+            return len(self._target)
+        try:
+            return os.fstat(self.save_file.fileno()).st_size
+        except (AttributeError, IOError, OSError, ValueError):
+            pos = self.save_file.tell()
+            size = self.save_file.seek(0, 2)
+            self.save_file.seek(pos)
+            return size
+
+    def __check(self, segments):
+        # compares end of every downloaded range with server, catches changed file on both sides
+        for start, end, pos in segments:
+            if pos > start:
+                size = min(self.journal_check_size, pos - start)
+                headers = {'User-Agent': 'Mozilla/5.0', 'Range': 'bytes={}-{}'.format(pos - size, pos - 1)}
+                resp = self.chomik.sess.get(self.chomik_file.url, headers=headers, timeout=self.chomik.transport.timeout)
+                if resp.status_code != 206 or resp.content != bytes(self.__read_at(pos - size, size)):
+                    return False
+        return True
+
+    def __restore(self):
+        state = self.journal.load()
+        if state is None or state.get('file_id') != self.chomik_file.file_id or state.get('size') != self.download_size:
+            return
+        segments = state.get('segments')
+        if not self.__valid_segments(segments, self.download_size) or (len(segments) > 1) != bool(self.segments):
+            return
+        try:
+            valid = self.__local_size() >= max(pos for _, _, pos in segments) and self.__check(segments)
+        except (IOError, OSError, ValueError):
+            valid = False
+        if not valid:
+            self.chomik.logger.debug('Journal of download "{n}" doesn\'t match downloaded data, starting over'.format(n=self.name))
+            return
+
+        if self.segments:
+            self.segments = segments
+        self.bytes_downloaded = sum(pos - start for start, _, pos in segments)
+        self.chomik.logger.debug('Continuing download "{n}" from journal, {b} bytes already downloaded'.format(n=self.name, b=self.bytes_downloaded))
+        if self.hashers:
+            with self._hash_lock:
+                if self.segments:
+                    self.__hash_written()
+                else:
+                    self.__hash_read_back(self.bytes_downloaded)
+        if not self.segments and self._target is None:
+            self.save_file.seek(self.bytes_downloaded)
+
+    def __sync(self):
+        # downloaded data has to reach disk before journal says it's there
+        if self._target is not None:
+            if isinstance(self.save_file, mmap.mmap):
+                self.save_file.flush()
+            return
+        with self._write_lock:
+            self.save_file.flush()
+            try:
+                os.fsync(self._fileno if self._fileno is not None else self.save_file.fileno())
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+
+    def __save_journal(self, force=False):
+        if self.journal is None:
+            return
+        now = time.time()
+        if not force and now - self._journal_saved < self.journal.interval:
+            return
+        self._journal_saved = now
+        segments = [list(segment) for segment in self.segments] if self.segments else [[0, self.download_size, self.bytes_downloaded]]
+        self.__sync()
+        self.journal.save({'file_id': self.chomik_file.file_id, 'size': self.download_size, 'segments': segments})
+
+    def __journal_done(self):
+        if self.journal is not None:
+            if self.finished:
+                self.journal.remove()
+            else:
+                self.__save_journal(True)
+
     def pause(self):
         self.paused = True
 
+    def _throttle(self, amount):
+        delay = reserve(amount, self.rate_limiter, self.chomik.download_limiter)
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def hexdigests(self):
+        return dict((name, h.hexdigest()) for name, h in dict_iteritems(self.hashers))
+
+    def __update_hashes(self, data):
+        for h in self.hashers.values():
+            h.update(data)
+        self._hashed += len(data)
+
+    def __hash(self, offset, data):
+        # data has to be hashed in file order, data written ahead of hashed position is read back later
+        if not self.hashers:
+            return
+        with self._hash_lock:
+            if offset == self._hashed:
+                self.__update_hashes(data)
+            if self.segments:
+                self.__hash_written()
+
+    def __hash_written(self):
+        for start, end, pos in self.segments:
+            if start <= self._hashed < end:
+                if pos > self._hashed:
+                    self.__hash_read_back(pos)
+                if pos < end:
+                    return
+
+    def __hash_read_back(self, end):
+        while self._hashed < end:
+            data = self.__read_at(self._hashed, min(end - self._hashed, 2 ** 20))
+            if not data:
+                raise IOError('Can\'t read back downloaded data for hashing')
+            self.__update_hashes(data)
+
+    def __read_at(self, offset, size):
+        if self._target is not None:
+            return self._target[offset:offset + size]
+        elif self._fileno is not None and hasattr(os, 'pread'):
+            return os.pread(self._fileno, size, offset)
+        with self._write_lock:
+            pos = self.save_file.tell()
+            self.save_file.seek(offset)
+            data = self.save_file.read(size)
+            self.save_file.seek(pos)
+        return data
+
+    def __write_at(self, offset, data):
+        if self._target is not None:
+            self._target[offset:offset + len(data)] = data
+        elif self._fileno is not None:
+            data = memoryview(data)
+            while data:
+                written = os.pwrite(self._fileno, data, offset)
+                data, offset = data[written:], offset + written
+        else:
+            with self._write_lock:
+                self.save_file.seek(offset)
+                self.save_file.write(data)
+
+    def __progress(self, size):
+        with self._lock:
+            self.bytes_downloaded += size
+            if self.progress_callback is not None:
+                self.progress_callback(self)
+            self.__save_journal()
+
+    def __chunks(self, resp):
+        if self.max_chunk_size is None:
+            for data in resp.iter_content(self.chunk_size):
+                yield data
+            return
+        # memoryviews of one buffer are yielded, each is valid only until next one is read
+        resp.raw.decode_content = True
+        buf, size = memoryview(bytearray(self.max_chunk_size)), self.chunk_size
+        while True:
+            n = resp.raw.readinto(buf[:size])
+            if not n:
+                return
+            yield buf[:n]
+            if n == size:
+                size = min(size * 2, self.max_chunk_size)
+
     def __dwn(self, headers):
-        with self.chomik.sess.get(self.chomik_file.url, stream=True, headers=headers) as resp:
-            if resp.status_code in (200, 206):
-                for data in resp.iter_content(self.chunk_size):
-                    self.save_file.write(data)
-                    self.bytes_downloaded += len(data)
-                    if self.progress_callback is not None:
-                        self.progress_callback(self)
-                    if self.paused:
-                        return 'paused'
-                self.finished = True
-                return True
-            else:
+        try:
+            with self.chomik.sess.get(self.chomik_file.url, stream=True, headers=headers, timeout=self.chomik.transport.timeout) as resp:
+                if resp.status_code in (200, 206):
+                    for data in self.__chunks(resp):
+                        self._throttle(len(data))
+                        if self._target is not None:
+                            self.__write_at(self.bytes_downloaded, data)
+                        else:
+                            self.save_file.write(data)
+                        self.__hash(self.bytes_downloaded, data)
+                        self.bytes_downloaded += len(data)
+                        if self.progress_callback is not None:
+                            self.progress_callback(self)
+                        self.__save_journal()
+                        if self.paused:
+                            return 'paused'
+                    self.finished = True
+                    return True
+                else:
+                    return False
+        finally:
+            self.__journal_done()
+
+    def __dwn_segment(self, segment):
+        start, end, pos = segment
+        if pos >= end:
+            return True
+        headers = {'User-Agent': 'Mozilla/5.0', 'Range': 'bytes={}-{}'.format(pos, end - 1)}
+        with self.chomik.sess.get(self.chomik_file.url, stream=True, headers=headers, timeout=self.chomik.transport.timeout) as resp:
+            if resp.status_code != 206:
                 return False
+            for data in self.__chunks(resp):
+                data = data[:end - segment[2]]
+                self._throttle(len(data))
+                self.__write_at(segment[2], data)
+                segment[2] += len(data)
+                self.__hash(segment[2] - len(data), data)
+                self.__progress(len(data))
+                if self.paused:
+                    return 'paused'
+            return segment[2] >= end
+
+    def __measured(self, download, *args):
+        downloaded, started = self.bytes_downloaded, clock()
+        try:
+            return download(*args)
+        finally:
+            self.chomik.metrics.transfer('download', self.bytes_downloaded - downloaded, clock() - started)
+
+    def __dwn_segmented(self):
+        results = [None] * len(self.segments)
+
+        def run(n, segment):
+            try:
+                results[n] = self.__dwn_segment(segment)
+            except Exception as e:
+                results[n] = e
+
+        threads = [threading.Thread(target=run, args=(n, segment)) for n, segment in enumerate(self.segments)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+
+        if all(r is True for r in results):
+            self.finished = True
+        self.__journal_done()
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+        if self.finished:
+            return True
+        if 'paused' in results:
+            return 'paused'
+        return False
 
     def start(self):
         if self.finished:
@@ -769,13 +2317,20 @@ class ChomikDownloader(object):
             raise UploadException('Tried to start already started download')
         self.started = True
 
+        if self.segments:
+            return self.__measured(self.__dwn_segmented)
         headers = {'User-Agent': 'Mozilla/5.0'}
-        return self.__dwn(headers)
+        if self.bytes_downloaded:
+            # continued from journal
+            headers['Range'] = 'bytes={}-'.format(self.bytes_downloaded)
+        return self.__measured(self.__dwn, headers)
 
     def resume(self):
         if self.finished:
             raise UploadException('Tried to resume finished download')
         self.paused = False
 
+        if self.segments:
+            return self.__measured(self.__dwn_segmented)
         headers = {'User-Agent': 'Mozilla/5.0', 'Range': 'bytes={}-'.format(self.bytes_downloaded)}
-        return self.__dwn(headers)
+        return self.__measured(self.__dwn, headers)
@@ -0,0 +1,378 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+
+from .ChomikBox import Chomik, ChomikFolder, ustr
+from .utils.DownloadJournal import load_json, save_json
+from .utils.UploadJournal import UploadJournal
+
+# state, upload journal and partial downloads are kept in synced directory under names starting with this prefix
+SYNC_PREFIX = '.chomiksync'
+
+
+def join_path(parent, name):
+    return parent + '/' + name if parent else name
+
+
+def split_path(path):
+    # (parent, name) of relative path
+    return tuple(path.rsplit('/', 1)) if '/' in path else ('', path)
+
+
+class SyncAction(object):
+    # kind: mkdir, upload, download, move, delete, rmdir
+    # source is remote ChomikFile replaced by upload / moved, or relative local path moved in download direction
+    def __init__(self, kind, path, size=0, source=None):
+        self.kind, self.path, self.size, self.source = kind, path, size, source
+        # pending -> done / failed
+        self.state, self.error = 'pending', None
+
+    def __repr__(self):
+        return '<ChomikBox.SyncAction: {k} "{p}" {s}>'.format(k=self.kind, p=self.path, s=self.state)
+
+
+class ChomikSync(object):
+    # one way sync of local directory and Chomik folder, direction is 'upload' (local -> Chomik) or 'download'
+    # files are compared by path and size, state saved after every sync also catches changes keeping size
+    # (local mtime, remote file id); with checksum local files with changed mtime are compared by md5 too
+    # with delete files and folders missing at source are removed from target, files found at other path
+    # with same name and size are moved instead of being transferred again
+    # interrupted sync continues where it stopped when run again, partial transfers are resumed from journals
+    # remote tree is listed with Chomik.crawl, so chomik with MetadataCache makes repeated runs cheap
+    def __init__(self, chomik, local_path, folder=None, direction='upload', delete=False, workers=4, attempts=3,
+                 checksum=False, exclude=None):
+        # exclude(relative path) returns True for files and folders which shouldn't be synced
+        if folder is None:
+            folder = chomik
+        elif isinstance(folder, ustr):
+            folder = chomik.get_path(folder)
+        assert isinstance(chomik, Chomik)
+        assert isinstance(local_path, ustr)
+        assert isinstance(folder, ChomikFolder)
+        assert direction in ('upload', 'download')
+        assert isinstance(workers, int) and workers > 0
+        assert callable(exclude) or exclude is None
+
+        self.chomik, self.local_path, self.folder, self.direction = chomik, local_path, folder, direction
+        self.delete, self.workers, self.attempts, self.checksum, self.exclude = delete, workers, attempts, checksum, exclude
+        self.state_path = os.path.join(local_path, SYNC_PREFIX)
+        self.upload_journal = UploadJournal(os.path.join(local_path, SYNC_PREFIX + '-uploads'))
+        self.logger = logging.getLogger('ChomikBox.ChomikSync.{}'.format(chomik.name))
+        self._lock = threading.Lock()
+        self._state, self._state_saved = {}, 0
+        self._remote_folders, self._unchanged = {}, []
+
+    def _local(self, path):
+        return os.path.join(self.local_path, *path.split('/'))
+
+    def _excluded(self, path):
+        return split_path(path)[1].startswith(SYNC_PREFIX) or (self.exclude is not None and self.exclude(path))
+
+    def local_manifest(self):
+        # relative path -> (size, mtime) of files and set of relative paths of folders
+        files, folders = {}, set()
+        for root, dirs, names in os.walk(self.local_path):
+            rel = os.path.relpath(root, self.local_path).replace(os.sep, '/')
+            rel = '' if rel == '.' else rel
+            dirs[:] = [d for d in dirs if not self._excluded(join_path(rel, d))]
+            folders.update(join_path(rel, d) for d in dirs)
+            for name in names:
+                path = join_path(rel, name)
+                if not self._excluded(path):
+                    stat = os.stat(os.path.join(root, name))
+                    files[path] = (stat.st_size, stat.st_mtime)
+        return files, folders
+
+    def remote_manifest(self):
+        # relative path -> ChomikFile and relative path -> ChomikFolder ('' is synced folder)
+        files, folders = {}, {'': self.folder}
+        prefix = len(self.folder.path)
+        for folder, folder_files in self.chomik.crawl(self.folder, self.workers, attempts=self.attempts):
+            rel = folder.path[prefix:].rstrip('/')
+            if rel and self._excluded(rel):
+                continue
+            folders[rel] = folder
+            for f in folder_files:
+                path = join_path(rel, f.name)
+                if not self._excluded(path):
+                    files[path] = f
+        # subfolders of excluded folders are listed by crawl too
+        for rel in list(folders):
+            parent = rel
+            while parent:
+                parent = split_path(parent)[0]
+                if parent not in folders:
+                    del folders[rel]
+                    break
+        files = dict((path, f) for path, f in files.items() if split_path(path)[0] in folders)
+        return files, folders
+
+    def _remote_path(self, file):
+        # relative path of remote file, as in remote_manifest
+        return join_path(file.parent_folder.path[len(self.folder.path):].rstrip('/'), file.name)
+
+    def _load_state(self):
+        state = load_json(self.state_path)
+        if isinstance(state, dict) and state.get('folder_id') == self.folder.folder_id and isinstance(state.get('files'), dict):
+            self._state = state['files']
+        else:
+            self._state = {}
+
+    def _save_state(self, force=False):
+        # called with self._lock held
+        now = time.time()
+        if force or now - self._state_saved > 1:
+            self._state_saved = now
+            save_json(self.state_path, {'folder_id': self.folder.folder_id, 'files': self._state})
+
+    def _md5(self, path):
+        h = md5()
+        with open(self._local(path), 'rb') as f:
+            for data in iter(lambda: f.read(2 ** 20), b''):
+                h.update(data)
+        return h.hexdigest()
+
+    def _local_changed(self, path, size, mtime, remote):
+        if remote.size != size:
+            return True
+        entry = self._state.get(path)
+        if entry is None or entry.get('file_id') != remote.file_id or entry.get('mtime') == mtime:
+            # same size and no history says otherwise
+            return False
+        if self.checksum and entry.get('md5'):
+            return self._md5(path) != entry['md5']
+        return True
+
+    def _remote_changed(self, path, size, remote):
+        if remote.size != size:
+            return True
+        entry = self._state.get(path)
+        return entry is not None and entry.get('file_id') != remote.file_id
+
+    @staticmethod
+    def _moves(sources, targets, key):
+        # pairs of (source, target) paths with unique same key, used ones are removed from sources and targets
+        by_key = {}
+        for path in sources:
+            by_key.setdefault(key(path, True), []).append(path)
+        moves = []
+        for path in list(targets):
+            candidates = by_key.get(key(path, False))
+            if candidates is not None and len(candidates) == 1:
+                source = candidates.pop()
+                moves.append((source, path))
+                sources.discard(source)
+                targets.discard(path)
+        return moves
+
+    @staticmethod
+    def _top_folders(folders):
+        # folders whose parent isn't in folders
+        return sorted(path for path in folders if split_path(path)[0] not in folders)
+
+    def plan(self):
+        # list of SyncAction needed to make target same as source
+        self._load_state()
+        local_files, local_folders = self.local_manifest()
+        remote_files, remote_folders = self.remote_manifest()
+        self._remote_folders, self._unchanged = remote_folders, []
+        if self.direction == 'upload':
+            return self._plan_upload(local_files, local_folders, remote_files, remote_folders)
+        return self._plan_download(local_files, local_folders, remote_files, remote_folders)
+
+    def _plan_upload(self, local_files, local_folders, remote_files, remote_folders):
+        actions = [SyncAction('mkdir', path) for path in sorted(local_folders - set(remote_folders))]
+        new, transfers = set(), []
+        for path, (size, mtime) in sorted(local_files.items()):
+            remote = remote_files.get(path)
+            if remote is None:
+                new.add(path)
+            elif self._local_changed(path, size, mtime, remote):
+                transfers.append(SyncAction('upload', path, size, remote))
+            else:
+                self._unchanged.append((path, size, mtime, remote.file_id))
+
+        extra_folders = set(remote_folders) - local_folders - {''}
+        removed = self._top_folders(extra_folders)
+        extra = set(path for path in remote_files if path not in local_files)
+        if self.delete:
+            moves = self._moves(extra, new, lambda path, remote: (split_path(path)[1],
+                                                                  remote_files[path].size if remote else local_files[path][0]))
+            actions += [SyncAction('move', target, remote_files[source].size, remote_files[source]) for source, target in moves]
+        transfers += [SyncAction('upload', path, local_files[path][0]) for path in sorted(new)]
+        actions += transfers
+        if self.delete:
+            # files of removed folders go away with them
+            actions += [SyncAction('delete', path, remote_files[path].size, remote_files[path]) for path in sorted(extra)
+                        if not any(path.startswith(folder + '/') for folder in removed)]
+            actions += [SyncAction('rmdir', path) for path in removed]
+        return actions
+
+    def _plan_download(self, local_files, local_folders, remote_files, remote_folders):
+        actions = [SyncAction('mkdir', path) for path in sorted(set(remote_folders) - local_folders - {''})]
+        new, transfers = set(), []
+        for path, remote in sorted(remote_files.items()):
+            if not remote.downloadable:
+                self.logger.debug('Skipping not downloadable file "{p}"'.format(p=path))
+                continue
+            local = local_files.get(path)
+            if local is None:
+                new.add(path)
+            elif self._remote_changed(path, local[0], remote):
+                transfers.append(SyncAction('download', path, remote.size, remote))
+            else:
+                self._unchanged.append((path, local[0], local[1], remote.file_id))
+
+        extra_folders = local_folders - set(remote_folders)
+        removed = self._top_folders(extra_folders)
+        extra = set(path for path in local_files if path not in remote_files)
+        if self.delete:
+            moves = self._moves(extra, new, lambda path, local: (split_path(path)[1],
+                                                                 local_files[path][0] if local else remote_files[path].size))
+            actions += [SyncAction('move', target, local_files[source][0], source) for source, target in moves]
+        transfers += [SyncAction('download', path, remote_files[path].size, remote_files[path]) for path in sorted(new)]
+        actions += transfers
+        if self.delete:
+            actions += [SyncAction('delete', path, local_files[path][0]) for path in sorted(extra)
+                        if not any(path.startswith(folder + '/') for folder in removed)]
+            actions += [SyncAction('rmdir', path) for path in removed]
+        return actions
+
+    def _record(self, path, entry=None):
+        with self._lock:
+            if entry is None:
+                self._state.pop(path, None)
+            else:
+                self._state[path] = entry
+            self._save_state()
+
+    def _entry(self, path, file_id, digest=None):
+        stat = os.stat(self._local(path))
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'file_id': file_id}
+        if digest is not None:
+            entry['md5'] = digest
+        return entry
+
+    def _mkdir(self, action):
+        if self.direction == 'upload':
+            parent, name = split_path(action.path)
+            self._remote_folders[action.path] = self.chomik.new_folder(name, self._remote_folders[parent])
+        elif not os.path.isdir(self._local(action.path)):
+            os.makedirs(self._local(action.path))
+
+    def _upload(self, action):
+        parent, name = split_path(action.path)
+        with open(self._local(action.path), 'rb') as f:
+            uploader = self.chomik.upload_file(f, name, None, self._remote_folders[parent],
+                                               hashes=('md5',) if self.checksum else None, journal=self.upload_journal)
+            file_id = uploader.start(self.attempts)
+        digest = uploader.hexdigests['md5'] if self.checksum else None
+        self._record(action.path, self._entry(action.path, int(file_id), digest))
+        # old version is removed only after new one is uploaded, so failed upload doesn't lose it
+        if action.source is not None and not self.chomik.remove_file(action.source):
+            raise IOError('Can\'t remove old version of "{}"'.format(action.path))
+
+    def _download(self, action):
+        # data goes to temporary file first, its journal lets next run continue interrupted download
+        target = self._local(action.path)
+        part = os.path.join(os.path.dirname(target), SYNC_PREFIX + '-part-' + os.path.basename(target))
+        journal = part + '.journal'
+        with open(part, 'r+b' if os.path.exists(part) and os.path.exists(journal) else 'wb') as f:
+            downloader = action.source.download(f, hashes=('md5',) if self.checksum else None, journal=journal)
+            result = downloader.start()
+            attempt = 1
+            while result is not True and (self.attempts == -1 or self.attempts >= attempt):
+                result = downloader.resume()
+                attempt += 1
+        if result is not True:
+            raise IOError('Download of "{}" failed'.format(action.path))
+        if os.path.exists(target):
+            os.remove(target)
+        os.rename(part, target)
+        digest = downloader.hexdigests['md5'] if self.checksum else None
+        self._record(action.path, self._entry(action.path, action.source.file_id, digest))
+
+    def _move(self, action):
+        if self.direction == 'upload':
+            source = self._remote_path(action.source)
+            if not self.chomik.move_file(action.source, self._remote_folders[split_path(action.path)[0]]):
+                raise IOError('Can\'t move "{}"'.format(action.path))
+            with self._lock:
+                self._state.pop(source, None)
+            self._record(action.path, self._entry(action.path, action.source.file_id))
+        else:
+            os.rename(self._local(action.source), self._local(action.path))
+            with self._lock:
+                entry = self._state.pop(action.source, None)
+            self._record(action.path, entry)
+
+    def _delete(self, action):
+        if self.direction == 'upload':
+            if not self.chomik.remove_file(action.source):
+                raise IOError('Can\'t remove "{}"'.format(action.path))
+        else:
+            os.remove(self._local(action.path))
+        self._record(action.path)
+
+    def _rmdir(self, action):
+        if self.direction == 'upload':
+            self.chomik.remove_folder(self._remote_folders[action.path], True)
+        else:
+            shutil.rmtree(self._local(action.path))
+        with self._lock:
+            for path in [path for path in self._state if path.startswith(action.path + '/')]:
+                del self._state[path]
+            self._save_state()
+
+    def _execute(self, action, progress_callback):
+        try:
+            getattr(self, '_' + action.kind)(action)
+        except Exception as e:
+            self.logger.debug('Sync action {a} failed: {e}'.format(a=action, e=e))
+            action.state, action.error = 'failed', e
+        else:
+            action.state = 'done'
+        if progress_callback is not None:
+            with self._lock:
+                progress_callback(self, action)
+        return action
+
+    def run(self, dry_run=False, progress_callback=None):
+        # plans and executes sync, returns list of actions with their states
+        # progress_callback(sync, action) is called after every action
+        actions = self.plan()
+        if dry_run:
+            return actions
+
+        # folders are created in order, so parents exist before their children
+        for action in actions:
+            if action.kind == 'mkdir':
+                self._execute(action, progress_callback)
+        failed = set(action.path for action in actions if action.kind == 'mkdir' and action.state == 'failed')
+
+        def runnable(action):
+            return not any(action.path.startswith(folder + '/') for folder in failed)
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            for _ in executor.map(lambda action: self._execute(action, progress_callback),
+                                  [action for action in actions if action.kind in ('move', 'upload', 'download', 'delete')
+                                   and runnable(action)]):
+                pass
+        for action in actions:
+            if action.kind == 'rmdir':
+                self._execute(action, progress_callback)
+
+        with self._lock:
+            # files which were already same at both sides are remembered, so later changes keeping size are found
+            for path, size, mtime, file_id in self._unchanged:
+                entry = self._state.get(path)
+                if entry is None or entry.get('mtime') != mtime or entry.get('file_id') != file_id:
+                    self._state[path] = {'size': size, 'mtime': mtime, 'file_id': file_id}
+            self._save_state(True)
+        return actions
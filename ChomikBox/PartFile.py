@@ -27,16 +27,18 @@ def total_len(o):
         length = o.seek(0, 2)
         o.seek(current_pos, 0)
         return length
-    except IOError:
+    except (AttributeError, IOError):
         pass
 
 
 class PartFile(io.IOBase):
-    def __init__(self, file, start):
+    # read_callback(position, data) is called after every read with absolute position of data in file
+    def __init__(self, file, start, read_callback=None):
         assert hasattr(file, 'read') and hasattr(file, 'tell') and hasattr(file, 'seek')
         assert isinstance(start, int)
+        assert callable(read_callback) or read_callback is None
 
-        self.file, self.start = file, start
+        self.file, self.start, self.read_callback = file, start, read_callback
         self.total_len = total_len(file)
         self.len = self.total_len - start
 
@@ -57,5 +59,16 @@ class PartFile(io.IOBase):
     def tell(self):
         return self.file.tell() - self.start
 
+    def read(self, size=-1):
+        if self.read_callback is None:
+            return self.file.read(size)
+        pos = self.file.tell()
+        data = self.file.read(size)
+        self.read_callback(pos, data)
+        return data
+
     def __getattr__(self, item):
+        # getvalue of whole file would make multipart encoder send it all instead of part
+        if item == 'getvalue':
+            raise AttributeError(item)
         return getattr(self.file, item)
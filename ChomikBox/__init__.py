@@ -1 +1,3 @@
-from .ChomikBox import Chomik, ChomikDownloader, ChomikUploader, ChomikFile, ChomikFolder
+from .ChomikBox import Chomik, ChomikDownloader, ChomikUploader, ChomikStreamUploader, ChomikUploadManager, ChomikFile, ChomikFileColumns, \
+    ChomikFolder
+from .ChomikSync import ChomikSync, SyncAction
@@ -0,0 +1,49 @@
+import json
+import os
+
+
+def load_json(path):
+    # returns None when file doesn't exist or is corrupted
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_json(path, data):
+    # written to temporary file first, so crash never leaves half written file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    if hasattr(os, 'replace'):
+        os.replace(tmp, path)
+    else:
+        # python 2 can't replace existing file on windows
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+
+
+class DownloadJournal(object):
+    # sidecar file with state of download (downloaded byte ranges), so it can be continued by other process after crash
+    # it's rewritten atomically at most once per interval seconds, and always when download is paused or fails
+    def __init__(self, path, interval=1.0):
+        self.path, self.interval = path, interval
+
+    def load(self):
+        # returns saved state or None if there is no (valid) journal
+        state = load_json(self.path)
+        return state if isinstance(state, dict) else None
+
+    def save(self, state):
+        save_json(self.path, state)
+
+    def remove(self):
+        for path in (self.path, self.path + '.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import time
+
+
+class MetadataCache(object):
+    # persistent folder and file listings cache, keyed by (chomik_id, folder_id)
+    schema = [
+        'CREATE TABLE IF NOT EXISTS listings (chomik_id INTEGER, folder_id INTEGER, kind TEXT, expires REAL, '
+        'PRIMARY KEY (chomik_id, folder_id, kind))',
+        'CREATE TABLE IF NOT EXISTS folders (chomik_id INTEGER, parent_id INTEGER, folder_id INTEGER, name TEXT, '
+        'hidden INTEGER, adult INTEGER, gallery_view INTEGER, password TEXT, PRIMARY KEY (chomik_id, folder_id))',
+        'CREATE INDEX IF NOT EXISTS folders_parent ON folders (chomik_id, parent_id)',
+        'CREATE TABLE IF NOT EXISTS files (chomik_id INTEGER, folder_id INTEGER, file_id INTEGER, name TEXT, '
+        'size INTEGER, url TEXT, PRIMARY KEY (chomik_id, file_id))',
+        'CREATE INDEX IF NOT EXISTS files_folder ON files (chomik_id, folder_id)',
+    ]
+
+    def __init__(self, path, folders_ttl=24 * 3600, files_ttl=3600):
+        # files_ttl should stay below download url lifetime
+        self.path, self.folders_ttl, self.files_ttl = path, folders_ttl, files_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            for statement in self.schema:
+                self._db.execute(statement)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _valid(self, chomik_id, folder_id, kind):
+        row = self._db.execute('SELECT expires FROM listings WHERE chomik_id = ? AND folder_id = ? AND kind = ?',
+                               (chomik_id, folder_id, kind)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def _set_listing(self, chomik_id, folder_id, kind, ttl):
+        self._db.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)', (chomik_id, folder_id, kind, time.time() + ttl))
+
+    def get_folders(self, chomik_id, folder_id):
+        # returns list of (folder_id, name, hidden, adult, gallery_view, password) or None if not cached
+        with self._lock:
+            if not self._valid(chomik_id, folder_id, 'folders'):
+                return None
+            rows = self._db.execute('SELECT folder_id, name, hidden, adult, gallery_view, password FROM folders '
+                                    'WHERE chomik_id = ? AND parent_id = ?', (chomik_id, folder_id)).fetchall()
+        return [(fid, name, bool(hidden), bool(adult), bool(gallery_view), password)
+                for fid, name, hidden, adult, gallery_view, password in rows]
+
+    def set_folders(self, chomik_id, folder_id, folders, ttl=None):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM folders WHERE chomik_id = ? AND parent_id = ?', (chomik_id, folder_id))
+            self._db.executemany('INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                 [(chomik_id, folder_id, fid, name, int(hidden), int(adult), int(gallery_view), password)
+                                  for fid, name, hidden, adult, gallery_view, password in folders])
+            self._set_listing(chomik_id, folder_id, 'folders', self.folders_ttl if ttl is None else ttl)
+
+    def get_files(self, chomik_id, folder_id):
+        # returns list of (file_id, name, size, url) or None if not cached
+        with self._lock:
+            if not self._valid(chomik_id, folder_id, 'files'):
+                return None
+            return self._db.execute('SELECT file_id, name, size, url FROM files WHERE chomik_id = ? AND folder_id = ?',
+                                    (chomik_id, folder_id)).fetchall()
+
+    def set_files(self, chomik_id, folder_id, files, ttl=None):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM files WHERE chomik_id = ? AND folder_id = ?', (chomik_id, folder_id))
+            self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                 [(chomik_id, folder_id, fid, name, size, url) for fid, name, size, url in files])
+            self._set_listing(chomik_id, folder_id, 'files', self.files_ttl if ttl is None else ttl)
+
+    def invalidate_folders(self, chomik_id, folder_id):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM listings WHERE chomik_id = ? AND folder_id = ? AND kind = ?', (chomik_id, folder_id, 'folders'))
+
+    def invalidate_files(self, chomik_id, folder_id):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM listings WHERE chomik_id = ? AND folder_id = ? AND kind = ?', (chomik_id, folder_id, 'files'))
+
+    def invalidate(self, chomik_id, folder_id):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM listings WHERE chomik_id = ? AND folder_id = ?', (chomik_id, folder_id))
+
+    def clear(self, chomik_id=None):
+        with self._lock, self._db:
+            for table in ('listings', 'folders', 'files'):
+                if chomik_id is None:
+                    self._db.execute('DELETE FROM {}'.format(table))
+                else:
+                    self._db.execute('DELETE FROM {} WHERE chomik_id = ?'.format(table), (chomik_id,))
@@ -0,0 +1,116 @@
+import threading
+import time
+from bisect import bisect_left
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Metrics(object):
+    # collector of Chomik metrics, this one drops everything, subclass it to send them elsewhere
+    # methods are called from many threads and on hot paths, so they should be cheap
+
+    def action(self, kind, action, latency, sent=0, received=0, parse_time=0, error=None):
+        # kind - 'soap' or 'web', latency and parse_time in seconds, sent/received - body sizes in bytes
+        # error - name of exception type when action failed
+        pass
+
+    def relogin(self, reason):
+        # reason - 'expired' (relogin_after elapsed), 'rejected' (token rejected by server) or 'keep_alive'
+        pass
+
+    def retry(self, name):
+        # name - action name, 'http' (retried by Transport), 'upload', 'download' or 'crawl'
+        pass
+
+    def transfer(self, direction, size, duration):
+        # direction - 'upload' or 'download', size in bytes sent in one request (or segmented download run)
+        pass
+
+    def snapshot(self):
+        return {}
+
+
+class Histogram(object):
+    # counts of values in buckets, bucket n holds values <= bounds[n], last one everything bigger
+    def __init__(self, bounds):
+        self.bounds, self.counts = bounds, [0] * (len(bounds) + 1)
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # upper bound of bucket holding q-quantile, max for last bucket
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[n], self.max) if n < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': list(zip(list(self.bounds) + [None], self.counts))}
+
+
+class MemoryMetrics(Metrics):
+    # keeps aggregated metrics in memory, snapshot returns them as dict of plain values (JSON serializable)
+    latency_bounds = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._actions, self._relogins, self._retries, self._transfers = {}, {}, {}, {}
+
+    def action(self, kind, action, latency, sent=0, received=0, parse_time=0, error=None):
+        with self._lock:
+            stats = self._actions.get((kind, action))
+            if stats is None:
+                stats = self._actions[(kind, action)] = {
+                    'latency': Histogram(self.latency_bounds), 'parse_time': Histogram(self.latency_bounds),
+                    'sent': 0, 'received': 0, 'errors': {}}
+            stats['latency'].add(latency)
+            stats['parse_time'].add(parse_time)
+            stats['sent'] += sent
+            stats['received'] += received
+            if error is not None:
+                stats['errors'][error] = stats['errors'].get(error, 0) + 1
+
+    def relogin(self, reason):
+        with self._lock:
+            self._relogins[reason] = self._relogins.get(reason, 0) + 1
+
+    def retry(self, name):
+        with self._lock:
+            self._retries[name] = self._retries.get(name, 0) + 1
+
+    def transfer(self, direction, size, duration):
+        with self._lock:
+            stats = self._transfers.setdefault(direction, {'count': 0, 'bytes': 0, 'seconds': 0.0})
+            stats['count'] += 1
+            stats['bytes'] += size
+            stats['seconds'] += duration
+
+    def snapshot(self):
+        with self._lock:
+            actions = {}
+            for (kind, action), stats in self._actions.items():
+                latency = stats['latency'].snapshot()
+                actions['{}:{}'.format(kind, action)] = {
+                    'count': latency['count'], 'errors': dict(stats['errors']), 'latency': latency,
+                    'parse_time': stats['parse_time'].snapshot(), 'sent': stats['sent'], 'received': stats['received']}
+            transfers = {}
+            for direction, stats in self._transfers.items():
+                transfers[direction] = dict(stats, throughput=stats['bytes'] / stats['seconds'] if stats['seconds'] else 0.0)
+            return {'actions': actions, 'relogins': dict(self._relogins), 'retries': dict(self._retries),
+                    'transfers': transfers}
@@ -0,0 +1,59 @@
+import threading
+import time
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class RateLimiter(object):
+    # token bucket, rate in bytes per second, burst is bucket size in bytes (one second of transfer by default)
+    # can be shared by many transfers and threads, rate can be changed while transfers are running
+    # bytes are taken from bucket up front and transfer waits until debt is paid, so throughput stays smooth
+    def __init__(self, rate, burst=None):
+        self._lock = threading.Lock()
+        self._rate, self._burst, self._tokens, self._stamp = None, None, 0, clock()
+        self.set_rate(rate, burst)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    def set_rate(self, rate, burst=None):
+        # rate None or 0 disables limiting
+        assert rate is None or rate >= 0
+        with self._lock:
+            self._refill()
+            if not self._rate:
+                self._tokens = burst if burst is not None else rate or 0
+            self._rate, self._burst = rate, burst if burst is not None else rate
+            if rate:
+                self._tokens = min(self._tokens, self._burst)
+
+    def _refill(self):
+        now = clock()
+        if self._rate:
+            self._tokens = min(self._burst, self._tokens + (now - self._stamp) * self._rate)
+        self._stamp = now
+
+    def reserve(self, amount):
+        # takes amount bytes from bucket, returns seconds to wait before transferring them
+        with self._lock:
+            if not self._rate:
+                return 0
+            self._refill()
+            self._tokens -= amount
+            return -self._tokens / float(self._rate) if self._tokens < 0 else 0
+
+    def consume(self, amount):
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def reserve(amount, *limiters):
+    # takes amount from all given limiters (None are skipped), returns longest wait
+    return max([limiter.reserve(amount) for limiter in limiters if limiter is not None] or [0])
@@ -0,0 +1,91 @@
+import threading
+from collections import deque
+
+
+class ReadAheadFile(object):
+    # reads file (e.g. PartFile) in background thread, so reading from disk overlaps with sending of read data
+    # at most buffer_size bytes are read ahead, blocks grow from min_block to max_block while consumer has to wait
+    # for them (reading is the bottleneck), file is read sequentially from its current position to size
+    def __init__(self, file, size, buffer_size=8 * 2 ** 20, min_block=2 ** 16, max_block=2 ** 20):
+        assert hasattr(file, 'read')
+        assert isinstance(size, int) and size >= 0
+        assert 0 < min_block <= max_block <= buffer_size
+
+        self.file, self.size, self.buffer_size = file, size, buffer_size
+        self.block_size, self.max_block = min_block, max_block
+        self._blocks, self._buffered, self._pos, self._read = deque(), 0, 0, 0
+        self._error, self._closed = None, False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='ChomikBox read-ahead')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def len(self):
+        # bytes left, used by multipart encoder
+        return self.size - self._pos
+
+    def tell(self):
+        return self._pos
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._closed and self._buffered >= self.buffer_size:
+                        self._cond.wait()
+                    if self._closed or self._read >= self.size:
+                        return
+                    size = min(self.block_size, self.size - self._read)
+                data = self.file.read(size)
+                with self._cond:
+                    if not data:
+                        # file is shorter than expected
+                        self.size = self._read
+                        self._cond.notify_all()
+                        return
+                    self._blocks.append(data)
+                    self._buffered += len(data)
+                    self._read += len(data)
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self._pos
+        out = []
+        with self._cond:
+            while size > 0 and self._pos < self.size:
+                if not self._blocks:
+                    if self._error is not None:
+                        raise self._error
+                    if self._closed:
+                        raise ValueError('I/O operation on closed file')
+                    # consumer is waiting for disk, bigger blocks are read
+                    self.block_size = min(self.block_size * 2, self.max_block)
+                    self._cond.wait()
+                    continue
+                block = self._blocks[0]
+                data = block[:size]
+                if len(data) == len(block):
+                    self._blocks.popleft()
+                else:
+                    self._blocks[0] = block[len(data):]
+                out.append(data)
+                size -= len(data)
+                self._pos += len(data)
+                self._buffered -= len(data)
+                self._cond.notify_all()
+        return b''.join(out)
+
+    def close(self):
+        # stops reading thread, after it file can be used by others again
+        with self._cond:
+            self._closed = True
+            self._blocks.clear()
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
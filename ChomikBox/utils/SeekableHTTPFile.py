@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from io import IOBase
 import cgi
 
@@ -8,12 +9,16 @@ import requests
 
 class SeekableHTTPFile(IOBase):
     # a bit based on https://github.com/valgur/pyhttpio
-    def __init__(self, url, name=None, requests_session=None, timeout=30):
+    # data is read ahead in blocks of block_size, last cache_blocks blocks are kept (LRU),
+    # seeks forward up to skip_limit bytes are done by reading live stream instead of reconnecting
+    def __init__(self, url, name=None, requests_session=None, timeout=30, block_size=2 ** 16, cache_blocks=16,
+                 skip_limit=2 ** 18):
         IOBase.__init__(self)
         self.url = url
         self.sess = requests_session if requests_session is not None else requests.session()
         self._seekable = False
         self.timeout = timeout
+        self.block_size, self.cache_blocks, self.skip_limit = block_size, cache_blocks, skip_limit
         f = self.sess.head(url, headers={'Range': 'bytes=0-'}, timeout=timeout)
         if f.status_code == 206 and 'Content-Range' in f.headers:
             self._seekable = True
@@ -28,6 +33,9 @@ class SeekableHTTPFile(IOBase):
         f.close()
         self._pos = 0
         self._r = None
+        # position of live stream, always at block boundary
+        self._r_pos = 0
+        self._blocks = OrderedDict()
 
     def seekable(self):
         return self._seekable
@@ -44,15 +52,50 @@ class SeekableHTTPFile(IOBase):
     def writable(self):
         return False
 
-    def _reopen_stream(self):
+    def close(self):
+        if self._r is not None:
+            self._r.close()
+        self._blocks.clear()
+        IOBase.close(self)
+
+    def _reopen_stream(self, pos):
         if self._r is not None:
             self._r.close()
         if self._seekable:
-            self._r = self.sess.get(self.url, headers={'Range': 'bytes={}-'.format(self._pos)}, stream=True, timeout=30)
+            self._r_pos = pos
+            self._r = self.sess.get(self.url, headers={'Range': 'bytes={}-'.format(pos)}, stream=True, timeout=self.timeout)
         else:
-            self._pos = 0
+            self._r_pos = 0
             self._r = self.sess.get(self.url, stream=True, timeout=self.timeout)
 
+    def _read_block(self):
+        data, missing = [], self.block_size
+        while missing:
+            chunk = self._r.raw.read(missing)
+            if not chunk:
+                break
+            data.append(chunk)
+            missing -= len(chunk)
+        block = b''.join(data)
+        self._blocks[self._r_pos // self.block_size] = block
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        self._r_pos += len(block)
+        return block
+
+    def _block(self, n):
+        if n in self._blocks:
+            block = self._blocks[n] = self._blocks.pop(n)
+            return block
+        start = n * self.block_size
+        stream_usable = self._r is not None and not self._r.raw.closed and self._r_pos <= start
+        if not stream_usable or (self._seekable and start - self._r_pos > self.skip_limit):
+            self._reopen_stream(start)
+        while self._r_pos < start:
+            if not self._read_block():
+                return b''
+        return self._read_block()
+
     def seek(self, offset, whence=0):
         if not self.seekable():
             raise OSError
@@ -63,15 +106,35 @@ class SeekableHTTPFile(IOBase):
         elif whence == 2:
             self._pos = self.len
         self._pos += offset
-        self._r.close()
         return self._pos
 
+    def readinto(self, b):
+        # copies cached blocks straight into b, without building intermediate bytes
+        view = memoryview(b)
+        amount = min(len(view), self.len - self._pos)
+        done = 0
+        while done < amount:
+            offset = self._pos % self.block_size
+            block = self._block(self._pos // self.block_size)
+            n = min(len(block) - offset, amount - done)
+            if n <= 0:
+                break
+            view[done:done + n] = memoryview(block)[offset:offset + n]
+            self._pos += n
+            done += n
+        return done
+
     def read(self, amount=-1):
-        if self._r is None or self._r.raw.closed:
-            self._reopen_stream()
-        if amount < 0:
-            content = self._r.raw.read()
-        else:
-            content = self._r.raw.read(amount)
-        self._pos += len(content)
-        return content
+        if amount is None or amount < 0:
+            amount = self.len - self._pos
+        amount = min(amount, self.len - self._pos)
+        content = []
+        while amount > 0:
+            offset = self._pos % self.block_size
+            chunk = self._block(self._pos // self.block_size)[offset:offset + amount]
+            if not chunk:
+                break
+            content.append(chunk)
+            self._pos += len(chunk)
+            amount -= len(chunk)
+        return b''.join(content)
@@ -0,0 +1,105 @@
+import io
+
+
+class StreamBuffer(io.RawIOBase):
+    # read-only file over iterator of bytes (e.g. generator) or non-seekable file (e.g. pipe) of unknown length
+    # last replay_size bytes before current position stay in memory, so it can seek back to them (to resume upload
+    # from offset reported by server), seeking outside of buffered part raises IOError
+    def __init__(self, source, replay_size=8 * 2 ** 20, chunk_size=2 ** 16):
+        assert hasattr(source, 'read') or hasattr(source, '__iter__')
+        assert isinstance(replay_size, int) and replay_size >= 0
+
+        io.RawIOBase.__init__(self)
+        self.source, self.replay_size, self.chunk_size = source, replay_size, chunk_size
+        self._iter = None if hasattr(source, 'read') else iter(source)
+        # [start, data] chunks covering [start of first, _end), small chunks are joined up to chunk_size
+        self._chunks, self._end, self._pos, self._eof = [], 0, 0, False
+
+    @property
+    def buffered_from(self):
+        # first position which can be seeked to
+        return self._chunks[0][0] if self._chunks else self._end
+
+    @property
+    def eof(self):
+        # True when whole source was already read into buffer
+        return self._eof
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def _pull(self):
+        # reads next chunk of source into buffer, returns False at end of source
+        if self._eof:
+            return False
+        if self._iter is None:
+            data = self.source.read(self.chunk_size)
+        else:
+            data = next(self._iter, b'')
+            while data is not None and not len(data):
+                data = next(self._iter, None)
+        if not data:
+            self._eof = True
+            return False
+        if self._chunks and len(self._chunks[-1][1]) < self.chunk_size:
+            self._chunks[-1][1] += bytes(data)
+        else:
+            self._chunks.append([self._end, bytes(data)])
+        self._end += len(data)
+        return True
+
+    def _trim(self):
+        drop = 0
+        while drop < len(self._chunks) and self._chunks[drop][0] + len(self._chunks[drop][1]) <= self._pos - self.replay_size:
+            drop += 1
+        del self._chunks[:drop]
+
+    def fill(self, size):
+        # reads ahead until size bytes after current position are buffered, returns True if source ended before
+        while self._end - self._pos < size:
+            if not self._pull():
+                return True
+        return False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._pull():
+                pass
+            size = self._end - self._pos
+        if self._pos >= self._end and not self._pull():
+            return b''
+        # position is usually in one of the last chunks
+        n = len(self._chunks) - 1
+        while self._chunks[n][0] > self._pos:
+            n -= 1
+        out, left = [], size
+        while n < len(self._chunks) and left > 0:
+            start, data = self._chunks[n]
+            data = data[self._pos - start:self._pos - start + left]
+            out.append(data)
+            self._pos += len(data)
+            left -= len(data)
+            n += 1
+        self._trim()
+        return b''.join(out)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence != 0:
+            raise IOError('Size of stream is unknown')
+        if not self.buffered_from <= offset <= self._end:
+            raise IOError('Position {} is not buffered'.format(offset))
+        self._pos = offset
+        return offset
@@ -0,0 +1,62 @@
+import requests
+from requests.adapters import HTTPAdapter
+# noinspection PyUnresolvedReferences
+from requests.packages.urllib3.util.retry import Retry
+
+
+class MeteredRetry(Retry):
+    metrics = None
+
+    def increment(self, *args, **kwargs):
+        self.metrics.retry('http')
+        return Retry.increment(self, *args, **kwargs)
+
+
+class Transport(object):
+    # connection pooling, retry and timeout settings shared by all HTTP sessions of Chomik
+    # pool_connections - count of hosts kept in pool (SOAP, web, download and upload servers)
+    # pool_maxsize - count of kept-alive connections per host, should be at least count of worker threads
+    # retries are done with exponential backoff, non idempotent requests (POST) are retried only on connection errors
+    # upload_read_timeout - seconds of waiting for response to uploaded file, server may process big file for a long
+    # time after receiving it, None for no limit
+    def __init__(self, pool_connections=16, pool_maxsize=32, pool_block=False, retries=3, backoff_factor=0.5,
+                 status_forcelist=(500, 502, 503, 504), connect_timeout=10, read_timeout=60, keep_alive=True,
+                 upload_read_timeout=600):
+        self.pool_connections, self.pool_maxsize, self.pool_block = pool_connections, pool_maxsize, pool_block
+        self.retries, self.backoff_factor, self.status_forcelist = retries, backoff_factor, status_forcelist
+        self.connect_timeout, self.read_timeout, self.upload_read_timeout = connect_timeout, read_timeout, upload_read_timeout
+        self.keep_alive = keep_alive
+
+    @property
+    def timeout(self):
+        # requests has no session wide timeout, so it has to be passed to every request
+        return self.connect_timeout, self.read_timeout
+
+    @property
+    def upload_timeout(self):
+        return self.connect_timeout, self.upload_read_timeout
+
+    def retry(self, metrics=None):
+        # retries are reported to metrics (Metrics) as 'http'
+        retry_class = Retry
+        if metrics is not None:
+            # urllib3 makes new Retry object for every retry with type(self), so metrics is kept in class
+            retry_class = type(str('MeteredRetry'), (MeteredRetry,), {'metrics': metrics})
+        return retry_class(total=self.retries, connect=self.retries, read=self.retries, status=self.retries,
+                           backoff_factor=self.backoff_factor, status_forcelist=self.status_forcelist, raise_on_status=False)
+
+    def adapter(self, metrics=None):
+        return HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                           max_retries=self.retry(metrics), pool_block=self.pool_block)
+
+    def mount(self, session, metrics=None):
+        assert isinstance(session, requests.Session)
+        adapter = self.adapter(metrics)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def session(self, metrics=None):
+        return self.mount(requests.session(), metrics)
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .DownloadJournal import load_json, save_json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+class UploadJournal(object):
+    # upload sessions (UploadToken key, stamp and server) of local files, so upload can be resumed by other process
+    # one journal holds many uploads, entry is removed when its upload finishes
+    # entry is used only if local file still has same size and mtime, and isn't older than max_age seconds
+    # journal can be shared by processes, its changes are done under lock of path + '.lock' file
+    def __init__(self, path, max_age=7 * 24 * 3600):
+        self.path, self.max_age = path, max_age
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        # thread lock first, file locks are held by process
+        with self._lock:
+            with open(self.path + '.lock', 'a+b') as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                elif msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                    elif msvcrt is not None:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @staticmethod
+    def file_info(file):
+        # (absolute path, size, mtime) of local file, None for other file-like objects
+        try:
+            path = os.path.abspath(file.name)
+            stat = os.fstat(file.fileno())
+        except (AttributeError, IOError, OSError, TypeError, ValueError):
+            return None
+        return path, stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def _key(chomik_id, folder_id, name, path):
+        return '{}:{}:{}:{}'.format(chomik_id, folder_id, name, path)
+
+    def _load(self):
+        entries = load_json(self.path)
+        return entries if isinstance(entries, dict) else {}
+
+    def find(self, file, chomik_id, folder_id, name):
+        # returns (key, stamp, server) of unfinished upload of file or None
+        info = self.file_info(file)
+        if info is None:
+            return None
+        path, size, mtime = info
+        with self._locked():
+            entry = self._load().get(self._key(chomik_id, folder_id, name, path))
+        if entry is None or entry.get('size') != size or entry.get('mtime') != mtime or \
+                time.time() - entry.get('created', 0) > self.max_age:
+            return None
+        return entry['key'], entry['stamp'], entry['server']
+
+    def add(self, file, chomik_id, folder_id, name, key, stamp, server):
+        info = self.file_info(file)
+        if info is None:
+            return False
+        path, size, mtime = info
+        with self._locked():
+            entries = self._load()
+            entries[self._key(chomik_id, folder_id, name, path)] = {
+                'chomik_id': chomik_id, 'folder_id': folder_id, 'name': name, 'path': path, 'size': size, 'mtime': mtime,
+                'key': key, 'stamp': stamp, 'server': server, 'created': time.time()}
+            save_json(self.path, entries)
+        return True
+
+    def remove(self, file, chomik_id, folder_id, name):
+        info = self.file_info(file)
+        if info is None:
+            return
+        with self._locked():
+            entries = self._load()
+            if entries.pop(self._key(chomik_id, folder_id, name, info[0]), None) is not None:
+                save_json(self.path, entries)
@@ -0,0 +1,238 @@
+from __future__ import print_function, unicode_literals
+
+import argparse
+import gc
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ChomikBox.ChomikBox import ChomikSOAP
+from ChomikBox.utils.Metrics import MemoryMetrics, clock
+
+from server import ENVELOPE, FakeChomik, FakeServer, FakeTree, file_content
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Benchmarks of pyChomikBox against local fake server, no Chomikuj account is needed
+# python benchmarks/bench.py --depth 3 --fanout 4 --files 20 --latency 0.01 --only listing get_path
+
+
+def timed(function, *args, **kwargs):
+    started = clock()
+    result = function(*args, **kwargs)
+    return clock() - started, result
+
+
+def new_chomik(server):
+    chomik = FakeChomik(server, metrics=MemoryMetrics())
+    chomik.login()
+    return chomik
+
+
+def bench_listing(server, args):
+    # whole tree listed with crawl, free files are resolved too
+    chomik = new_chomik(server)
+    server.reset_stats()
+    duration, listings = timed(lambda: [len(files) for _, files in chomik.crawl(workers=args.workers)])
+    folders, files = len(listings), sum(listings)
+    return {'seconds': duration, 'folders': folders, 'files': files, 'folders/s': folders / duration,
+            'files/s': files / duration, 'requests': server.stats.get('requests', 0)}
+
+
+def bench_get_path(server, args):
+    # cold - every path resolved by fresh client, warm - same paths again with loaded tree
+    paths = random.Random(0).sample(server.tree.file_paths, min(args.paths, len(server.tree.file_paths)))
+    chomik = new_chomik(server)
+    server.reset_stats()
+    cold, _ = timed(lambda: [chomik.get_path(path) for path in paths])
+    requests = server.stats.get('requests', 0)
+    warm, _ = timed(lambda: [chomik.get_path(path) for path in paths for _ in range(10)])
+    return {'paths': len(paths), 'cold ms/path': cold * 1000 / len(paths), 'cold requests': requests,
+            'warm us/path': warm * 1e6 / (len(paths) * 10)}
+
+
+def bench_parse(server, args):
+    # Folders and Download responses of given size parsed whole (unpack) and streamed (iterparse), both into
+    # ChomikFolder/ChomikFile objects
+    tree = FakeTree(args.parse_entries, 1, 0)
+    folders = ENVELOPE.format(a='Folders', body=tree.folders_response(0, 2)).encode('utf-8')
+    for n in range(args.parse_entries):
+        tree.add_file(0, 'file{}.bin'.format(n), 1024)
+    files = ENVELOPE.format(a='Download', body=tree.files_response(
+        ''.join(tree.file_xml(i, server.url, True) for i in tree.files))).encode('utf-8')
+
+    chomik = FakeChomik(server)
+
+    def unpack(action, xml):
+        return ChomikSOAP.unpack(xml)['{}Response'.format(action)]['{}Result'.format(action)]
+
+    parsers = (
+        ('Folders', folders,
+         lambda: chomik._folders_from_data(chomik, unpack('Folders', folders)['a:folder']['folders'], 2),
+         lambda: [chomik._folder_tree_from_elem(e, chomik, 2) for _, e in ChomikSOAP.iterparse(io.BytesIO(folders), {'FolderInfo'})]),
+        ('Download', files,
+         lambda: chomik._files_from_data(chomik, unpack('Download', files)),
+         lambda: [chomik._file_from_elem(chomik, e)[0] for _, e in ChomikSOAP.iterparse(io.BytesIO(files), {'FileEntry'})]))
+    result = {'entries': args.parse_entries}
+    for name, xml, whole, streamed in parsers:
+        assert len(whole()) == len(streamed()) == args.parse_entries
+        unpack_time, _ = timed(lambda: [whole() for _ in range(args.repeat)])
+        iterparse_time, _ = timed(lambda: [streamed() for _ in range(args.repeat)])
+        result['{} KiB'.format(name)] = len(xml) / 1024.0
+        result['{} unpack ms'.format(name)] = unpack_time * 1000 / args.repeat
+        result['{} iterparse ms'.format(name)] = iterparse_time * 1000 / args.repeat
+    return result
+
+
+def bench_transfer(server, args):
+    size = args.transfer_size * 2 ** 20
+    chomik = new_chomik(server)
+    data = os.urandom(2 ** 20) * args.transfer_size
+    result = {'MiB': args.transfer_size}
+
+    upload, file_id = timed(lambda: chomik.upload_file(io.BytesIO(data), 'bench.bin').start())
+    result['upload MB/s'] = size / upload / 1e6
+    chomik.upload_read_ahead = 8 * 2 ** 20
+    upload, _ = timed(lambda: chomik.upload_file(io.BytesIO(data), 'bench-read-ahead.bin').start())
+    chomik.upload_read_ahead = None
+    result['upload read-ahead MB/s'] = size / upload / 1e6
+    chomik_file = next(f for f in chomik.files_list() if f.file_id == int(file_id))
+    for segments in (1, 4):
+        buf = io.BytesIO()
+        duration, _ = timed(lambda: chomik_file.download(buf, segments=segments, max_chunk_size=2 ** 20).start())
+        assert len(buf.getvalue()) == size
+        result['download x{} MB/s'.format(segments)] = size / duration / 1e6
+
+    # hashed segments are read back from file, write-only one is rejected up front
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        with open(path, 'wb') as f:
+            try:
+                chomik_file.download(f, segments=4, hashes=['md5'])
+            except ValueError as e:
+                result['write-only hashed download error'] = type(e).__name__
+            else:
+                raise AssertionError('Hashed download with segments into write-only file did not raise')
+        with open(path, 'w+b') as f:
+            downloader = chomik_file.download(f, segments=4, hashes=['md5'])
+            duration, _ = timed(downloader.start)
+            assert downloader.hexdigests['md5'] == hashlib.md5(file_content(chomik_file.file_id, 0, size)).hexdigest()
+        result['download x4 md5 MB/s'] = size / duration / 1e6
+    finally:
+        os.remove(path)
+    return result
+
+
+def bench_faults(server, args):
+    # SOAP Faults (HTTP 500 and 200 without status) of streamed actions raise and aren't cached as empty listings,
+    # crawl retries them
+    chomik = new_chomik(server)
+    result = {}
+    for status in (500, 200):
+        server.fail('Folders', status)
+        try:
+            chomik.folders_list()
+        except Exception as e:
+            result['Folders {} error'.format(status)] = type(e).__name__
+        else:
+            raise AssertionError('Folders with SOAP Fault (HTTP {}) did not raise'.format(status))
+        server.fail('Download', status)
+        try:
+            chomik.files_list()
+        except Exception as e:
+            result['Download {} error'.format(status)] = type(e).__name__
+        else:
+            raise AssertionError('Download with SOAP Fault (HTTP {}) did not raise'.format(status))
+    assert chomik.folders_list() and chomik.files_list()
+
+    server.fail('Folders', 500, 200)
+    chomik = new_chomik(server)
+    folders = sum(1 for _ in chomik.crawl(workers=args.workers))
+    assert folders == len(server.tree.folders), folders
+    result['crawl retries'] = chomik.metrics.snapshot()['retries'].get('crawl', 0)
+    return result
+
+
+def bench_async(server, args):
+    try:
+        from bench_async import bench_async
+    except (ImportError, SyntaxError) as e:
+        return {'error': 'AsyncChomik is not available ({})'.format(e)}
+    return bench_async(server, args)
+
+
+def bench_memory(server, args):
+    # memory held by listed tree, per file, for file objects and for columns
+    if tracemalloc is None:
+        return {'error': 'tracemalloc is not available'}
+    result = {}
+    for name, listing in (('objects', lambda c, folders: [c.files_list(folder=folder) for folder in folders]),
+                          ('columns', lambda c, folders: c.files_columns(folders))):
+        chomik = new_chomik(server)
+        chomik.load_tree()
+        folders, stack = [], [chomik]
+        while stack:
+            folders.append(stack.pop())
+            stack.extend(chomik.folders_list(folders[-1]))
+        gc.collect()
+        tracemalloc.start()
+        kept = listing(chomik, folders)
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        files = len(kept) if name == 'columns' else sum(len(files) for files in kept)
+        result['{} bytes/file'.format(name)] = current / float(files)
+        del kept
+    return result
+
+
+BENCHMARKS = [('listing', bench_listing), ('get_path', bench_get_path), ('parse', bench_parse),
+              ('transfer', bench_transfer), ('faults', bench_faults), ('async', bench_async),
+              ('memory', bench_memory)]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--fanout', type=int, default=4, help="Subfolders of every folder")
+    p.add_argument('--depth', type=int, default=3, help="Depth of folder tree")
+    p.add_argument('--files', type=int, default=20, help="Files in every folder")
+    p.add_argument('--latency', type=float, default=0, help="Seconds added to every request")
+    p.add_argument('--bandwidth', type=float, default=None, help="Bytes per second of every connection")
+    p.add_argument('--workers', type=int, default=8, help="Worker threads of crawl")
+    p.add_argument('--paths', type=int, default=200, help="Paths resolved by get_path benchmark")
+    p.add_argument('--parse-entries', type=int, default=5000, help="Entries in parsed responses")
+    p.add_argument('--transfer-size', type=int, default=32, help="MiB uploaded and downloaded")
+    p.add_argument('--repeat', type=int, default=5, help="Repeats of parse benchmark")
+    p.add_argument('--only', nargs='*', choices=[name for name, _ in BENCHMARKS], help="Benchmarks to run")
+    p.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = p.parse_args()
+
+    server = FakeServer(FakeTree(args.fanout, args.depth, args.files), args.latency, args.bandwidth).start()
+    results = {}
+    try:
+        for name, benchmark in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            results[name] = benchmark(server, args)
+            if not args.json:
+                print(name)
+                for key, value in sorted(results[name].items()):
+                    print('  {:<24} {}'.format(key, round(value, 3) if isinstance(value, float) else value))
+    finally:
+        server.stop()
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
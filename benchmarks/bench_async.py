@@ -0,0 +1,54 @@
+import asyncio
+import io
+
+from ChomikBox.AsyncChomik import AsyncChomik
+from ChomikBox.ChomikBox import UnsupportedOperation
+from ChomikBox.utils.Metrics import MemoryMetrics, clock
+
+from server import FakeChomik
+
+# AsyncChomik part of benchmarks, separate module as it needs python 3.6+ and aiohttp
+
+
+class FakeAsyncChomik(AsyncChomik):
+    # AsyncChomik talking to FakeServer instead of Chomikuj
+    def __init__(self, server, name='bench', password='bench', **kwargs):
+        self.server = server
+        AsyncChomik.__init__(self, name, password, ssl=False, **kwargs)
+
+    _action_request = FakeChomik._action_request
+    _web_action_request = FakeChomik._web_action_request
+    _logged_in = FakeChomik._logged_in
+
+
+async def run(server, args):
+    # whole tree crawled, then ChomikFile methods of async files are checked: download works, sync only ones raise
+    async with FakeAsyncChomik(server, metrics=MemoryMetrics()) as chomik:
+        await chomik.login()
+        started, folders, files = clock(), 0, 0
+        async for _, folder_files in chomik.crawl(workers=args.workers):
+            folders, files = folders + 1, files + len(folder_files)
+        duration = clock() - started
+        result = {'seconds': duration, 'folders': folders, 'files': files, 'folders/s': folders / duration,
+                  'files/s': files / duration}
+
+        chomik_file = next(f for f in await chomik.files_list() if f.downloadable)
+        buf = io.BytesIO()
+        assert await chomik_file.download(buf).start() is True
+        assert len(buf.getvalue()) == chomik_file.size
+        for name, call in (('open', chomik_file.open), ('segmented download', lambda: chomik_file.download(io.BytesIO(), segments=4))):
+            try:
+                call()
+            except UnsupportedOperation:
+                result['{} error'.format(name)] = 'UnsupportedOperation'
+            else:
+                raise AssertionError('{} of AsyncChomik file did not raise'.format(name))
+        return result
+
+
+def bench_async(server, args):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run(server, args))
+    finally:
+        loop.close()
@@ -0,0 +1,412 @@
+from __future__ import unicode_literals
+
+import json
+import re
+import threading
+import time
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+try:
+    # noinspection PyCompatibility
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    # noinspection PyCompatibility
+    from socketserver import ThreadingMixIn
+    # noinspection PyCompatibility
+    from urllib.parse import parse_qsl, unquote_plus
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    # noinspection PyUnresolvedReferences
+    from SocketServer import ThreadingMixIn
+    # noinspection PyUnresolvedReferences
+    from urlparse import parse_qsl
+    # noinspection PyUnresolvedReferences
+    from urllib import unquote_plus
+
+from ChomikBox import Chomik
+
+# Local stand-in of Chomikuj servers used by benchmarks, it speaks just enough of ChomikBox protocol for Chomik:
+# SOAP actions (Auth, Logout, Folders, Download, UploadToken, AddFolder, RemoveFolder, others just succeed),
+# web actions of files, upload (/file/, /resume/check/) and ranged downloads of generated file contents
+# SOAP Faults can be injected with FakeServer.fail
+
+NS = '{http://chomikuj.pl/}'
+ENVELOPE = ('<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body><{a}Response xmlns="http://chomikuj.pl/">'
+            '<{a}Result xmlns:a="http://chomikuj.pl" xmlns:i="http://www.w3.org/2001/XMLSchema-instance">{body}</{a}Result>'
+            '</{a}Response></s:Body></s:Envelope>')
+FAULT = ('<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body><s:Fault><faultcode>s:Server</faultcode>'
+         '<faultstring>{}</faultstring></s:Fault></s:Body></s:Envelope>')
+
+# contents of file are bytes (file_id + offset) % 251, sent as slices of this pattern
+PATTERN_PERIOD = 251
+PATTERN = bytearray(i % PATTERN_PERIOD for i in range(PATTERN_PERIOD + 2 ** 16))
+
+
+def file_content(file_id, start, end):
+    out = bytearray()
+    while start < end:
+        offset = (file_id + start) % PATTERN_PERIOD
+        size = min(end - start, len(PATTERN) - offset)
+        out += PATTERN[offset:offset + size]
+        start += size
+    return bytes(out)
+
+
+class FakeTree(object):
+    # folders with fanout subfolders up to depth levels, every folder has files files of size bytes
+    # every second file is "free" one, so its url has to be resolved with additional Download request
+    def __init__(self, fanout=3, depth=3, files=10, size=1024):
+        self.folders = {0: {'name': '', 'parent': None, 'children': []}}
+        self.files = {}
+        self._lock = threading.Lock()
+        self._next_file = 1000
+
+        stack = [(0, 0)]
+        while stack:
+            parent, level = stack.pop()
+            for n in range(files):
+                self.add_file(parent, 'file{}.bin'.format(n), size, free=n % 2 == 1)
+            if level < depth:
+                for n in range(fanout):
+                    stack.append((self.add_folder(parent, 'dir{}'.format(n)), level + 1))
+
+    def add_folder(self, parent, name):
+        with self._lock:
+            folder_id = max(self.folders) + 1
+            self.folders[folder_id] = {'name': name, 'parent': parent, 'children': []}
+            self.folders[parent]['children'].append(folder_id)
+            return folder_id
+
+    def add_file(self, folder, name, size, free=False):
+        with self._lock:
+            file_id, self._next_file = self._next_file, self._next_file + 1
+            self.files[file_id] = {'name': name, 'folder': folder, 'size': size, 'free': free}
+            return file_id
+
+    def move_folder(self, folder_id, to):
+        with self._lock:
+            folder = self.folders[folder_id]
+            self.folders[folder['parent']]['children'].remove(folder_id)
+            self.folders[to]['children'].append(folder_id)
+            folder['parent'] = to
+
+    def remove_folder(self, folder_id):
+        with self._lock:
+            self.folders[self.folders[folder_id]['parent']]['children'].remove(folder_id)
+            stack = [folder_id]
+            while stack:
+                folder = self.folders.pop(stack.pop())
+                stack.extend(folder['children'])
+            for file_id in [i for i, f in self.files.items() if f['folder'] not in self.folders]:
+                del self.files[file_id]
+
+    def path(self, folder_id):
+        path = '/'
+        while folder_id:
+            path = '/' + self.folders[folder_id]['name'] + path
+            folder_id = self.folders[folder_id]['parent']
+        return path
+
+    def folder_by_path(self, path):
+        folder_id = 0
+        for name in path.strip('/').split('/') if path.strip('/') else ():
+            folder_id = next(c for c in self.folders[folder_id]['children'] if self.folders[c]['name'] == name)
+        return folder_id
+
+    def folder_files(self, folder_id):
+        return sorted(i for i, f in self.files.items() if f['folder'] == folder_id)
+
+    @property
+    def file_paths(self):
+        return [self.path(f['folder']) + f['name'] for f in self.files.values()]
+
+    def folder_xml(self, folder_id, depth):
+        folder = self.folders[folder_id]
+        inner = ''
+        if depth > 1:
+            inner = '<folders>{}</folders>'.format(''.join(self.folder_xml(c, depth - 1) for c in folder['children']))
+        return ('<FolderInfo><id>{}</id><name>{}</name><hidden>false</hidden><adult>false</adult><view><gallery>false</gallery>'
+                '</view><passwd>false</passwd><password i:nil="true"/>{}</FolderInfo>').format(folder_id, escape(folder['name']), inner)
+
+    def folders_response(self, folder_id, depth):
+        return '<a:status>Ok</a:status><a:folder><id>{}</id><folders>{}</folders></a:folder>'.format(
+            folder_id, ''.join(self.folder_xml(c, depth - 1) for c in self.folders[folder_id]['children']))
+
+    def file_xml(self, file_id, url, resolve_free):
+        # url - base url of downloads
+        f = self.files[file_id]
+        url = '<url i:nil="true"/>' if f['free'] and not resolve_free else '<url>{}/dl/{}</url>'.format(url, file_id)
+        return ('<FileEntry><id>{}</id><name>{}</name><size>{}</size>{}<agreementInfo>'
+                '<AgreementInfo><name>own</name><cost>1</cost></AgreementInfo>'
+                '<AgreementInfo><name>free</name><cost>0</cost></AgreementInfo></agreementInfo></FileEntry>').format(
+            file_id, escape(f['name']), f['size'], url)
+
+    @staticmethod
+    def files_response(files_xml):
+        if not files_xml:
+            return '<a:status>Error</a:status><a:errorMessage>failed : requested file(s) not available</a:errorMessage>'
+        return '<a:status>Ok</a:status><a:list><DownloadFolder><files>{}</files></DownloadFolder></a:list>'.format(files_xml)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, with Nagle every keep-alive request would wait for delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, name):
+        with self.server.lock:
+            self.server.stats[name] = self.server.stats.get(name, 0) + 1
+
+    def _send_bytes(self, data):
+        # data is sent in chunks, sleeping to keep bandwidth
+        for start in range(0, len(data), 2 ** 16):
+            chunk = data[start:start + 2 ** 16]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / float(self.server.bandwidth))
+
+    def send(self, body, status=200, content_type='text/xml; charset=utf-8', headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self._send_bytes(body)
+
+    def _read(self, size):
+        data = self.rfile.read(size)
+        if self.server.bandwidth:
+            time.sleep(len(data) / float(self.server.bandwidth))
+        return data
+
+    def _body_chunks(self):
+        if 'Content-Length' in self.headers:
+            left = int(self.headers['Content-Length'])
+            while left > 0:
+                data = self._read(min(left, 2 ** 16))
+                if not data:
+                    return
+                left -= len(data)
+                yield data
+        else:
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return
+                yield self._read(size)
+                self.rfile.readline()
+
+    def _body(self):
+        return b''.join(self._body_chunks())
+
+    def soap_action(self, action, request):
+        tree = self.server.tree
+        value = lambda name: request.find(NS + name).text
+        if action == 'Auth':
+            return ('<a:status>Ok</a:status><a:errorMessage i:nil="true"/><a:hamsterId>1</a:hamsterId><a:token>token</a:token>'
+                    '<a:hamsterName>{}</a:hamsterName>').format(escape(value('name')))
+        elif action == 'Folders':
+            return tree.folders_response(int(value('folderId')), int(value('depth')))
+        elif action == 'Download':
+            out = ''
+            for entry in request.find(NS + 'list').findall(NS + 'DownloadReqEntry'):
+                entry_id = entry.find(NS + 'id').text
+                agreement = entry.find(NS + 'agreementInfo')[0].find(NS + 'name').text
+                if entry_id.startswith('/'):
+                    # /chomik_name/folder/path/
+                    path = unquote_plus(entry_id.replace('*', '%')).split('/', 2)[2]
+                    out += ''.join(tree.file_xml(i, self.server.url, False) for i in tree.folder_files(tree.folder_by_path(path)))
+                else:
+                    out += tree.file_xml(int(entry_id), self.server.url, agreement == 'free')
+            return tree.files_response(out)
+        elif action == 'UploadToken':
+            with self.server.lock:
+                key = 'key{}'.format(len(self.server.uploads))
+                self.server.uploads[key] = {'folder': int(value('folderId')), 'name': value('fileName'), 'size': 0}
+            return '<a:status>Ok</a:status><a:key>{}</a:key><a:stamp>0</a:stamp><a:server>{}:{}</a:server>'.format(
+                key, self.server.server_address[0], self.server.server_address[1])
+        elif action == 'AddFolder':
+            folder_id = tree.add_folder(int(value('newFolderId')), value('name'))
+            return '<a:status>Ok</a:status><a:folderId>{}</a:folderId>'.format(folder_id)
+        elif action in ('RemoveFolder', 'MoveFolder', 'RenameFolder', 'ModifyFolder'):
+            folder_id = int(value('folderId'))
+            if folder_id not in tree.folders:
+                return '<a:status>Error</a:status><a:errorMessage>folder not found</a:errorMessage>'
+            if action == 'RemoveFolder':
+                tree.remove_folder(folder_id)
+            elif action == 'MoveFolder':
+                tree.move_folder(folder_id, int(value('newFolderId')))
+            elif action == 'RenameFolder':
+                tree.folders[folder_id]['name'] = value('name')
+        return '<a:status>Ok</a:status>'
+
+    def web_action(self, action, data):
+        tree = self.server.tree
+        if action.startswith('FileDetails/') and int(data.get('FileId', 0)) in tree.files:
+            f = tree.files[int(data['FileId'])]
+            if action == 'FileDetails/MoveFileAction':
+                f['folder'] = int(data['FolderTo'])
+            elif action == 'FileDetails/DeleteFileAction':
+                del tree.files[int(data['FileId'])]
+            elif action == 'FileDetails/EditNameAndDescAction':
+                f['name'] = data['Name'] + f['name'][f['name'].rfind('.'):] if '.' in f['name'] else data['Name']
+            return {'IsSuccess': True}
+        return {'IsSuccess': False}
+
+    def upload(self):
+        # multipart body is streamed, only fields before file and its size are kept
+        boundary = re.search(r'boundary=(\S+)', self.headers['Content-Type']).group(1).encode('ascii')
+        trailer = b'\r\n--' + boundary + b'--\r\n'
+        head, size, tail = b'', None, b''
+        for data in self._body_chunks():
+            if size is None:
+                head += data
+                match = re.search(br'filename="[^"]*"\r\n(?:[^\r\n]+\r\n)*\r\n', head)
+                if match is None:
+                    continue
+                data, head, size = head[match.end():], head[:match.end()], 0
+            data = tail + data
+            size += max(len(data) - len(trailer), 0)
+            tail = data[-len(trailer):]
+        fields = dict((name.decode('utf-8'), value.decode('utf-8'))
+                      for name, value in re.findall(br'name="(\w+)"\r\n\r\n(.*?)\r\n', head))
+        with self.server.lock:
+            upload = self.server.uploads.get(fields.get('key'))
+            if upload is None or size is None:
+                return '<resp res="0" errorMessage="bad request"/>'
+            if tail != trailer:
+                # client stopped sending (paused upload), received part can be resumed
+                upload['size'] = int(fields.get('resume_from', 0)) + size + len(tail)
+                return None
+            upload['size'] = int(fields.get('resume_from', 0)) + size
+        file_id = self.server.tree.add_file(upload['folder'], upload['name'], upload['size'])
+        return '<resp res="1" fileid="{}"/>'.format(file_id)
+
+    def do_POST(self):
+        self._count('requests')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.path.startswith('/services/'):
+            action = self.headers['SOAPAction'].rsplit('/', 1)[1]
+            self._count(action)
+            request = ElementTree.fromstring(self._body())[0][0]
+            with self.server.lock:
+                faults = self.server.faults.get(action)
+                status = faults.pop(0) if faults else None
+            if status is not None:
+                self.send(FAULT.format('Injected fault'), status)
+            else:
+                self.send(ENVELOPE.format(a=action, body=self.soap_action(action, request)))
+        elif self.path.startswith('/action/'):
+            action = self.path[len('/action/'):]
+            self._count(action)
+            data = dict(parse_qsl(self._body().decode('utf-8')))
+            self.send(json.dumps(self.web_action(action, data)), content_type='application/json')
+        elif self.path.startswith('/file/'):
+            self._count('upload')
+            resp = self.upload()
+            if resp is None:
+                self.close_connection = True
+            else:
+                self.send(resp)
+        else:
+            self._body()
+            self.send('', 404)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        self._count('requests')
+        if self.path.startswith('/dl/'):
+            self._count('download')
+            file_id = int(self.path[len('/dl/'):])
+            size = self.server.tree.files[file_id]['size']
+            ranges = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if ranges is None:
+                start, end, status, headers = 0, size, 200, {}
+            else:
+                start, end = int(ranges.group(1)), int(ranges.group(2)) + 1 if ranges.group(2) else size
+                status, headers = 206, {'Content-Range': 'bytes {}-{}/{}'.format(start, end - 1, size)}
+            headers['Accept-Ranges'] = 'bytes'
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                for pos in range(start, end, 2 ** 20):
+                    self._send_bytes(file_content(file_id, pos, min(pos + 2 ** 20, end)))
+        elif self.path.startswith('/resume/check/'):
+            key = self.path.split('key=', 1)[1]
+            with self.server.lock:
+                size = self.server.uploads[key]['size'] if key in self.server.uploads else 0
+            self.send('<resp file_size="{}"/>'.format(size))
+        else:
+            # web login
+            self.send('ok', content_type='text/html')
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    # latency - seconds added to every request, bandwidth - bytes per second of every connection (None for unlimited)
+    daemon_threads = True
+
+    def __init__(self, tree=None, latency=0, bandwidth=None, address=('127.0.0.1', 0)):
+        HTTPServer.__init__(self, address, FakeHandler)
+        self.tree = FakeTree() if tree is None else tree
+        self.latency, self.bandwidth = latency, bandwidth
+        self.lock = threading.Lock()
+        self.stats, self.uploads, self.faults = {}, {}, {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.server_address[0], self.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+
+    def fail(self, action, *statuses):
+        # next requests of SOAP action are answered with SOAP Fault, one for every given HTTP status (e.g. 500)
+        with self.lock:
+            self.faults.setdefault(action, []).extend(statuses)
+
+
+class FakeChomik(Chomik):
+    # Chomik talking to FakeServer instead of Chomikuj
+    def __init__(self, server, name='bench', password='bench', **kwargs):
+        self.server = server
+        Chomik.__init__(self, name, password, ssl=False, **kwargs)
+
+    def _action_request(self, action, data):
+        url, body, headers = Chomik._action_request(self, action, data)
+        return self.server.url + '/services/ChomikBoxService.svc', body, headers
+
+    def _web_action_request(self, action):
+        url, headers = Chomik._web_action_request(self, action)
+        return self.server.url + '/action/' + action, headers
+
+    def _logged_in(self, resp):
+        url, params = Chomik._logged_in(self, resp)
+        return self.server.url + '/login', params
@@ -11,7 +11,7 @@ from ChomikBox.ChomikBox import Chomik, ChomikFolder, ChomikFile
 # TODO: investigate misterious redirections at some files..
 
 workers = 20
-chunk_size = 2 ** 12  # 4KiB
+chunk_size = 2 ** 20  # 1MiB
 max_errors_per_file = 5
 skip_hashed = True
 out_f = r'C:\Users\Junior\Nextcloud\dev\msdn\chomik.sha1'
@@ -38,17 +38,15 @@ args = p.parse_args()
 
 c = Chomik(args.login, args.password)
 c.login()
-folders = [c.get_path(path) for path in paths]
 files = []
 
-while folders:
-    for f in folders:
-        if isinstance(f, ChomikFile):
-            files.append(f)
-        elif isinstance(f, ChomikFolder):
-            folders.extend(f.folders_list())
-            files.extend(f.files_list(only_downloadable=True))
-        folders.remove(f)
+for path in paths:
+    f = c.get_path(path)
+    if isinstance(f, ChomikFile):
+        files.append(f)
+    elif isinstance(f, ChomikFolder):
+        for folder, folder_files in f.crawl(workers=workers, only_downloadable=True):
+            files.extend(folder_files)
 
 if skip_hashed:
     with open(out_f, 'r') as f:
@@ -60,11 +58,14 @@ if skip_hashed:
 def gen_sha1(file):
     f = file.open()
     sha = hashlib.sha1()
+    # one buffer per file is reused for all reads
+    buf = memoryview(bytearray(chunk_size))
     while True:
-        block = f.read(chunk_size)
-        if not block:
+        n = f.readinto(buf)
+        if not n:
             break
-        sha.update(block)
+        sha.update(buf[:n])
+    f.close()
     return sha.hexdigest()
 
 
@@ -6,6 +6,7 @@ from ChomikBox.ChomikBox import Chomik, ChomikFolder, ChomikFile
 
 
 paths = ['/prywatne/MSDN/']
+workers = 8
 out_f = r'g:\msdn\chomik.txt'
 
 
@@ -17,17 +18,15 @@ args = p.parse_args()
 c = Chomik(args.login, args.password)
 c.login()
 
-folders = [c.get_path(path) for path in paths]
 files = []
 
-while folders:
-    for f in folders:
-        if isinstance(f, ChomikFile):
-            files.append(f)
-        elif isinstance(f, ChomikFolder):
-            folders.extend(f.folders_list())
-            files.extend(f.files_list(only_downloadable=True))
-        folders.remove(f)
+for path in paths:
+    f = c.get_path(path)
+    if isinstance(f, ChomikFile):
+        files.append(f)
+    elif isinstance(f, ChomikFolder):
+        for folder, folder_files in f.crawl(workers=workers, only_downloadable=True):
+            files.extend(folder_files)
 
 with open(out_f, 'w') as out:
     for f in files:
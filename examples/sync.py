@@ -0,0 +1,26 @@
+import argparse
+
+from ChomikBox import Chomik, ChomikSync
+
+# This code mirrors local directory to Chomik folder (or Chomik folder to local directory with --download)
+
+
+p = argparse.ArgumentParser()
+p.add_argument('login', help="Chomikuj login/email")
+p.add_argument('password', help="Chomikuj password")
+p.add_argument('local', help="Local directory")
+p.add_argument('remote', help="Chomik folder path")
+p.add_argument('--download', action='store_true', help="Sync from Chomik to local directory")
+p.add_argument('--delete', action='store_true', help="Remove files missing at source")
+p.add_argument('--dry-run', action='store_true', help="Only print planned actions")
+args = p.parse_args()
+
+c = Chomik(args.login, args.password)
+c.login()
+
+sync = ChomikSync(c, args.local, args.remote, 'download' if args.download else 'upload', args.delete, workers=4)
+for action in sync.run(args.dry_run, lambda s, a: print(a)):
+    if args.dry_run:
+        print(action)
+
+c.logout()
@@ -10,7 +10,7 @@ with open('README.rst') as f:
     long_description = f.read()
 
 __version__ = about['__version__']
-required = ['requests', 'requests_toolbelt', 'xmltodict']
+required = ['requests', 'requests_toolbelt', 'xmltodict', 'futures; python_version < "3.2"']
 
 setup(
     name='pyChomikBox',
@@ -22,6 +22,7 @@ setup(
     url='https://github.com/JuniorJPDJ/pyChomikBox',
     packages=find_packages(exclude=['contrib', 'docs', 'tests', 'examples']),
     install_requires=required,
+    extras_require={'async': ['aiohttp']},
     license='LGPLv3+',
     python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*, <4',
     keywords="chomikuj chomik file share sharing upload download uploader downloader",